@@ -1,26 +1,26 @@
-from flask import Flask, request, jsonify, send_from_directory, render_template, send_file, flash, redirect, url_for
+from flask import (Flask, Response, request, jsonify, send_from_directory, render_template, send_file, flash,
+                   redirect, url_for, stream_with_context)
 from flask_cors import CORS
 import os
 import sys
 import json
-import uuid
+import logging
 import shutil
+import tempfile
+import metrics
 from split_pdf import split_pdf
+from jobs import JobQueue, QueueFullError, JOB_DONE, JOB_FAILED
+from result_cache import DocumentCache
+from storage import SessionStorage
+from model_loader import BackgroundModel, MODEL_LOADING, MODEL_READY
 
 # Add ml_prototype to path so we can import the extractor
 sys.path.append(os.path.join(os.path.dirname(__file__), 'ml_prototype'))
 
-# Try importing ML modules, warn if missing
-try:
-    from layoutlmv3_extractor import load_model, preprocess_document, run_inference, structure_output, LABELS_MAP
-    ML_AVAILABLE = True
-except ImportError as e:
-    print(f"Warning: ML module import failed: {e}")
-    ML_AVAILABLE = False
-
-# Check for poppler
-if shutil.which('pdftoppm') is None:
-    print("WARNING: 'pdftoppm' (poppler) not found in PATH. PDF processing will fail.")
+# LOG_LEVEL=DEBUG adds the verbose dumps (page-1 text, per-chunk calls,
+# full extraction results); aggregate timings are on /metrics
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format='%(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__, static_folder='.', template_folder='templates')
 app.secret_key = 'supersecretkey'
@@ -29,18 +29,63 @@ CORS(app)
 # Configuration for Splitter
 app.config['UPLOAD_FOLDER'] = os.path.join(os.getcwd(), 'uploads')
 app.config['OUTPUT_FOLDER'] = os.path.join(os.getcwd(), 'processed')
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
+app.config['STORAGE_FOLDER'] = os.path.join(os.getcwd(), 'storage')
+app.config['STORAGE_QUOTA_MB'] = int(os.environ.get('STORAGE_QUOTA_MB', 2048))
+os.makedirs(app.config['STORAGE_FOLDER'], exist_ok=True)
 
-# Load model once at startup if available
-if ML_AVAILABLE:
-    print("Loading LayoutLMv3 Model...")
-    try:
-        model, processor = load_model()
-        print("Model Loaded!")
-    except Exception as e:
-        print(f"Failed to load model: {e}")
-        ML_AVAILABLE = False
+# split_pdf's page workers are spawned processes, which import this module
+# again as __mp_main__ when the server runs as `python app.py`. Only the
+# serving process opens the storage and cache indexes and starts the model
+# loaders; a worker just needs the module to import.
+SERVING_PROCESS = __name__ != '__mp_main__'
+
+# Session folders are hardlinks into a content-addressed blob store, with
+# LRU eviction of whole sessions once the quota is exceeded
+if SERVING_PROCESS:
+    storage = SessionStorage(app.config['UPLOAD_FOLDER'], app.config['OUTPUT_FOLDER'],
+                             app.config['STORAGE_FOLDER'],
+                             max_bytes=app.config['STORAGE_QUOTA_MB'] * 1024 * 1024)
+
+# Background job pool for split + extraction (keeps large uploads out of the request thread)
+app.config['SPLIT_WORKERS'] = int(os.environ.get('SPLIT_WORKERS', 2))
+app.config['SPLIT_MAX_PENDING'] = int(os.environ.get('SPLIT_MAX_PENDING', 16))
+split_jobs = JobQueue(max_workers=app.config['SPLIT_WORKERS'],
+                      max_pending=app.config['SPLIT_MAX_PENDING'])
+# Worker processes per split for large PDFs (page-parallel split_pdf); 0 = serial
+app.config['SPLIT_PAGE_WORKERS'] = int(os.environ.get('SPLIT_PAGE_WORKERS', 0))
+
+# Whole-document result cache (identical PDF + prompt + model + chunker -> stored outputs)
+app.config['CACHE_FOLDER'] = os.path.join(os.getcwd(), 'cache', 'documents')
+app.config['DOCUMENT_CACHE_MAX_MB'] = int(os.environ.get('DOCUMENT_CACHE_MAX_MB', 512))
+if SERVING_PROCESS:
+    document_cache = DocumentCache(app.config['CACHE_FOLDER'],
+                                   max_bytes=app.config['DOCUMENT_CACHE_MAX_MB'] * 1024 * 1024)
+
+app.config['INFERENCE_MAX_BATCH'] = int(os.environ.get('INFERENCE_MAX_BATCH', 8))
+app.config['INFERENCE_MAX_WAIT_MS'] = float(os.environ.get('INFERENCE_MAX_WAIT_MS', 20))
+# /api/process_document keeps uploads up to this size in memory
+app.config['IN_MEMORY_UPLOAD_MB'] = int(os.environ.get('IN_MEMORY_UPLOAD_MB', 64))
+# torch (fp32), int8, onnx or onnx-int8
+app.config['LAYOUTLM_BACKEND'] = os.environ.get('LAYOUTLM_BACKEND', 'torch')
+
+def _load_layoutlm():
+    # torch/transformers are only imported here, on the loader thread
+    from layoutlmv3_extractor import load_model
+    from batch_inference import BatchInferenceWorker
+    model, processor = load_model(app.config['LAYOUTLM_BACKEND'])
+    # Concurrent /api/process_document requests share forward passes
+    batcher = BatchInferenceWorker(model,
+                                   max_batch_size=app.config['INFERENCE_MAX_BATCH'],
+                                   max_wait_ms=app.config['INFERENCE_MAX_WAIT_MS'])
+    return model, processor, batcher
+
+# Load the LayoutLMv3 model in the background so startup isn't blocked on it.
+# Set LOAD_LAYOUTLM=0 for a splitter-only deployment.
+layoutlm = BackgroundModel("LayoutLMv3", _load_layoutlm)
+if os.environ.get('LOAD_LAYOUTLM', '1') == '0':
+    layoutlm.disable("Disabled by LOAD_LAYOUTLM=0")
+elif SERVING_PROCESS:
+    layoutlm.start()
 
 # --- Routes for Existing LayoutLMv3 App ---
 
@@ -59,10 +104,36 @@ def static_files(path):
     # Flask matches explicit routes first.
     return send_from_directory('.', path)
 
+@app.route('/health')
+def health():
+    """Liveness: the server is up; reports the state of each component."""
+    return jsonify({
+        "status": "ok",
+        "layoutlm": layoutlm.status(),
+        "ollama": ollama_warmup.status(),
+        "split_jobs": split_jobs.stats(),
+        "storage": storage.stats(),
+        "document_cache": document_cache.stats(),
+    })
+
+@app.route('/ready')
+def ready():
+    """Readiness: 200 once the LayoutLMv3 model can serve requests."""
+    status = layoutlm.status()
+    return jsonify(status), (200 if layoutlm.state == MODEL_READY else 503)
+
 @app.route('/api/process_document', methods=['POST'])
 def process_document_api():
-    if not ML_AVAILABLE:
-        return jsonify({"error": "ML Model not available"}), 503
+    if layoutlm.state == MODEL_LOADING:
+        response = jsonify({"error": "ML Model is warming up, retry shortly", "status": "warming_up"})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    if layoutlm.state != MODEL_READY:
+        return jsonify({"error": "ML Model not available", "detail": layoutlm.status().get("error")}), 503
+
+    from layoutlmv3_extractor import (preprocess_document, extract_document, structure_output, structure_pages,
+                                      covered_word_count, merge_window_logits, LABELS_MAP, OUTPUT_FORMATS)
+    _, processor, batcher = layoutlm.value
 
     if 'file' not in request.files:
         return jsonify({"error": "No file part"}), 400
@@ -71,22 +142,78 @@ def process_document_api():
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
 
-    if file:
-        temp_path = os.path.join('ml_prototype', 'temp_upload.pdf')
-        file.save(temp_path)
-        
-        try:
-            encoding, words, boxes = preprocess_document(temp_path, processor)
-            if encoding is None:
+    # format=records (one row per word, default), entities (merged B-/I- spans)
+    # or compact (columnar words + entities)
+    output_format = request.form.get('format') or request.args.get('format', 'records')
+    if output_format not in OUTPUT_FORMATS:
+        return jsonify({"error": f"Unknown format '{output_format}'", "formats": list(OUTPUT_FORMATS)}), 400
+
+    # Work from the uploaded bytes so concurrent requests never share a file;
+    # only uploads too large to hold in memory go to a per-request temp file
+    with metrics.span("upload_save"):
+        pdf_source, temp_path = _read_upload(file)
+
+    # mode=document runs every page (long pages as sliding windows);
+    # the default only looks at the first page
+    mode = request.form.get('mode') or request.args.get('mode', 'page')
+
+    try:
+        if mode == 'document':
+            def infer(encodings):
+                futures = [batcher.submit(encoding) for encoding in encodings]
+                return [future.result() for future in futures]
+
+            pages = extract_document(pdf_source, processor, infer)
+            if pages is None:
                 return jsonify({"error": "Failed to process PDF"}), 500
+            return jsonify(structure_pages(pages, LABELS_MAP, output_format))
 
-            predictions = run_inference(model, encoding)
-            aligned_predictions = predictions[:len(words)]
-            result = structure_output(words, boxes, aligned_predictions, LABELS_MAP)
-            return jsonify(result)
-        except Exception as e:
-            print(f"Error processing document: {e}")
-            return jsonify({"error": str(e)}), 500
+        encoding, words, boxes = preprocess_document(pdf_source, processor)
+        if encoding is None:
+            return jsonify({"error": "Failed to process PDF"}), 500
+
+        logits = batcher.submit(encoding).result()
+        # Sub-word tokens -> words; words cut off by truncation are dropped
+        num_words = covered_word_count(encoding)
+        word_logits = merge_window_logits(encoding, logits, num_words)
+        result = structure_output(words[:num_words], boxes[:num_words], word_logits, LABELS_MAP, output_format)
+        return jsonify(result)
+    except Exception as e:
+        print(f"Error processing document: {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if temp_path:
+            os.remove(temp_path)
+
+def _read_upload(file):
+    """
+    Returns (pdf_source, temp_path): the upload's bytes, or for uploads over
+    IN_MEMORY_UPLOAD_MB the path of a private temp file the caller removes.
+    """
+    stream = file.stream
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    if size <= app.config['IN_MEMORY_UPLOAD_MB'] * 1024 * 1024:
+        return stream.read(), None
+    fd, temp_path = tempfile.mkstemp(suffix='.pdf', prefix='upload-')
+    with os.fdopen(fd, 'wb') as f:
+        shutil.copyfileobj(stream, f)
+    return temp_path, temp_path
+
+@app.route('/api/inference_stats')
+def inference_stats():
+    if layoutlm.state != MODEL_READY:
+        return jsonify(layoutlm.status()), 503
+    _, _, batcher = layoutlm.value
+    stats = batcher.stats()
+    stats["backend"] = app.config['LAYOUTLM_BACKEND']
+    return jsonify(stats)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Stage timings and LLM/chunk counters in the Prometheus text format."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/splitter')
 def splitter_index():
@@ -95,12 +222,78 @@ def splitter_index():
 # --- Routes for Gemini/TinyLlama Extraction ---
 
 # from gemini_service import extract_entities  <-- Removed
-from tinyllama_service import extract_entities_ollama
+from tinyllama_service import (extract_entities_ollama, extraction_complete, extraction_fingerprint, preload_llm,
+                               TINYLLAMA_MODEL)
+
+# Load the extraction model in Ollama (and warm its system prompt) at startup
+# instead of on the first upload. Set PRELOAD_OLLAMA=0 to skip.
+ollama_warmup = BackgroundModel(f"Ollama {TINYLLAMA_MODEL}", preload_llm)
+if os.environ.get('PRELOAD_OLLAMA', '1') == '0':
+    ollama_warmup.disable("Disabled by PRELOAD_OLLAMA=0")
+elif SERVING_PROCESS:
+    ollama_warmup.start()
 
 # Load environment variables (Still useful for other things, but not for API key now)
 from dotenv import load_dotenv
 load_dotenv()
 
+def _wants_json():
+    best = request.accept_mimetypes.best_match(['application/json', 'text/html'])
+    return best == 'application/json'
+
+def _cache_bypassed():
+    flag = request.form.get('no_cache') or request.args.get('no_cache') or ''
+    return flag.lower() in ('1', 'true', 'yes', 'on')
+
+def process_split_job(session_id, file_path, session_output_dir, cache_key=None, emit=None):
+    """
+    Runs the split + extraction pipeline for one uploaded PDF.
+    Executed on the split job pool, never in the request thread.
+    Successful results are stored in the document cache under cache_key.
+    Progress ("split", then one "chunk" per finished chunk) goes to `emit`,
+    which the job queue streams to /jobs/<job_id>/events.
+    """
+    try:
+        return _run_split_pipeline(session_id, file_path, session_output_dir, cache_key,
+                                   emit or (lambda event, data=None: None))
+    finally:
+        # Dedup the outputs into the blob store and make the session evictable
+        storage.commit_outputs(session_id)
+
+def _run_split_pipeline(session_id, file_path, session_output_dir, cache_key, emit):
+    # 1. Split PDF (also hands back the page text it read while the PDF was open)
+    with metrics.span("split"):
+        text_pdf, images_pdf, page_texts = split_pdf(file_path, output_folder=session_output_dir,
+                                                     with_text=True, workers=app.config['SPLIT_PAGE_WORKERS'])
+    filenames = {
+        "text_filename": "text_only.pdf" if text_pdf else None,
+        "images_filename": "images_only.pdf" if images_pdf else None,
+    }
+    emit("split", dict(session_id=session_id, pages=len(page_texts), **filenames))
+
+    def on_chunk(index, items, cache_hit):
+        emit("chunk", {"index": index, "items": items, "cached": cache_hit})
+
+    # 2. Extract Entities via TinyLlama (Local) - using the split's page text
+    if text_pdf is None:
+        error = "Splitting failed: text_only.pdf could not be created"
+        return dict(session_id=session_id, extraction_result={"error": error}, **filenames)
+    try:
+        # A cache bypass (no cache_key) re-asks the LLM for every chunk too
+        extraction_result = extract_entities_ollama(text_pdf, use_cache=cache_key is not None,
+                                                    pages=page_texts, on_chunk=on_chunk)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Extraction result for %s:\n%s", session_id, json.dumps(extraction_result, indent=2))
+    except Exception as ml_err:
+        print(f"TinyLlama Extraction failed: {ml_err}")
+        extraction_result = {"error": str(ml_err)}
+
+    # Results with failed or incomplete chunks are not cached, so a re-upload tries again
+    if cache_key and images_pdf and extraction_complete(extraction_result):
+        document_cache.put(cache_key, session_output_dir, extraction_result)
+
+    return dict(session_id=session_id, extraction_result=extraction_result, **filenames)
+
 @app.route('/upload_split', methods=['POST'])
 def upload_file_split():
     if 'file' not in request.files:
@@ -113,52 +306,113 @@ def upload_file_split():
         return redirect(url_for('splitter_index'))
     
     if file and file.filename.lower().endswith('.pdf'):
-        session_id = str(uuid.uuid4())
-        session_upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], session_id)
-        session_output_dir = os.path.join(app.config['OUTPUT_FOLDER'], session_id)
-        
-        os.makedirs(session_upload_dir, exist_ok=True)
-        os.makedirs(session_output_dir, exist_ok=True)
-        
-        file_path = os.path.join(session_upload_dir, file.filename)
-        file.save(file_path)
+        with metrics.span("upload_save"):
+            session_id, file_path, content_hash = storage.create_session(file, file.filename)
+        session_output_dir = storage.output_dir(session_id)
+
+        cache_key = None
+        if not _cache_bypassed():
+            cache_key = DocumentCache.make_key(content_hash,
+                                               extraction_fingerprint(text_source="pymupdf"))
+            extraction_result = document_cache.get(cache_key, session_output_dir)
+            if extraction_result is not None:
+                print(f"Document cache hit for {session_id}")
+                storage.commit_outputs(session_id)
+                result = {
+                    "session_id": session_id,
+                    "text_filename": "text_only.pdf",
+                    "images_filename": "images_only.pdf",
+                    "extraction_result": extraction_result,
+                    "cached": True,
+                }
+                if _wants_json():
+                    return jsonify(result)
+                return render_template('splitter.html', result=True, **result)
         
         try:
-            # 1. Split PDF
-            text_pdf, images_pdf = split_pdf(file_path, output_folder=session_output_dir)
-            
-            # 2. Extract Entities via TinyLlama (Local) - using the Text-Only PDF
-            try:
-                # Pass the path to the text-only PDF
-                extraction_result = extract_entities_ollama(text_pdf)
-                import json
-                print(f"DEBUG: Extraction Result for {session_id}:")
-                print(json.dumps(extraction_result, indent=2))
-            except Exception as ml_err:
-                print(f"TinyLlama Extraction failed: {ml_err}")
-                extraction_result = {"error": str(ml_err)}
-
-            return render_template('splitter.html', 
-                                   result=True, 
-                                   session_id=session_id,
-                                   text_filename="text_only.pdf",
-                                   images_filename="images_only.pdf",
-                                   extraction_result=extraction_result)
-                                   
-        except Exception as e:
-            flash(f'Error processing file: {str(e)}')
+            job_id = split_jobs.submit(process_split_job, session_id, file_path,
+                                       session_output_dir, cache_key, emit_events=True)
+        except QueueFullError:
+            storage.commit_outputs(session_id)
+            if _wants_json():
+                return jsonify({"error": "Server busy, try again later"}), 503
+            flash('Server is busy processing other documents. Please try again shortly.')
             return redirect(url_for('splitter_index'))
+
+        if _wants_json():
+            return jsonify({
+                "job_id": job_id,
+                "status_url": url_for('split_job_status', job_id=job_id),
+                "result_url": url_for('split_job_result', job_id=job_id),
+                "events_url": url_for('split_job_events', job_id=job_id),
+            }), 202
+
+        return render_template('splitter.html', job_id=job_id)
             
     else:
         flash('Invalid file type. Please upload a PDF.')
         return redirect(url_for('splitter_index'))
 
+@app.route('/jobs/<job_id>')
+def split_job_status(job_id):
+    job = split_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/events')
+def split_job_events(job_id):
+    """
+    Server-sent events for a split job: "split" when the PDFs are written,
+    "chunk" with each chunk's entities as it finishes, then "done" with the
+    final deduplicated result (or "failed"). Reconnecting clients resume
+    after their Last-Event-ID.
+    """
+    if split_jobs.get(job_id) is None:
+        return jsonify({"error": "Unknown job"}), 404
+    try:
+        after = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        after = 0
+
+    def stream():
+        for item in split_jobs.events(job_id, after=after):
+            if item is None:
+                yield ": keep-alive\n\n"
+                continue
+            seq, event, data = item
+            yield f"id: {seq}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs/<job_id>/result')
+def split_job_result(job_id):
+    job = split_jobs.get(job_id)
+    if job is None:
+        flash('Job not found or expired.')
+        return redirect(url_for('splitter_index'))
+
+    if job['status'] == JOB_FAILED:
+        flash(f"Error processing file: {job['error']}")
+        return redirect(url_for('splitter_index'))
+
+    if job['status'] != JOB_DONE:
+        # Still running - show the polling page again
+        return render_template('splitter.html', job_id=job_id)
+
+    storage.touch(job['result']['session_id'])
+    return render_template('splitter.html', result=True, **job['result'])
+
 @app.route('/download_split/<session_id>/<filename>')
 def download_file_split(session_id, filename):
-    directory = os.path.join(app.config['OUTPUT_FOLDER'], session_id)
-    return send_file(os.path.join(directory, filename), as_attachment=True)
+    path = storage.output_path(session_id, filename)
+    if path is None:
+        return jsonify({"error": "File not found or expired"}), 404
+    return send_file(path, as_attachment=True)
 
 if __name__ == '__main__':
     # Use port 8000 to match previous config, or 5000? 
     # Remote used 8000. Let's stick to 8000.
-    app.run(port=8000, debug=True)
+    # Requests share no files on disk, so they can be served concurrently
+    app.run(port=8000, debug=True, threaded=True)
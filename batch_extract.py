@@ -0,0 +1,219 @@
+"""
+Batch split + extraction for whole directories of control narratives.
+
+Walks INPUT_DIR for PDFs, splits them with split_pdf in a process pool
+(the page text comes back with the split, so no PDF is parsed twice) and
+extracts entities with a bounded number of LLM calls in flight across all
+documents. Each finished document appends one line to results.jsonl.
+
+manifest.jsonl records every document by the SHA-256 of its content
+together with the extraction settings key, so an interrupted or repeated
+run skips files that are already done (renamed or duplicate files
+included) and only retries the failed, incomplete (some chunks had no
+LLM answer, e.g. Ollama went away mid-run) or unfinished ones. Split outputs go
+to OUTPUT_DIR/<sha256[:16]>/. A document that is processed again (after a
+failure or an interruption) gets a new results line; the last line per
+sha256 is the current one.
+
+Usage:
+    python batch_extract.py INPUT_DIR OUTPUT_DIR [--split-workers 4] [--llm-concurrency 2]
+                            [--documents 2] [--no-cache]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from result_cache import DocumentCache, file_sha256
+from split_pdf import split_pdf
+
+MANIFEST_FILE = "manifest.jsonl"
+RESULTS_FILE = "results.jsonl"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+# Extracted, but with failed or incomplete chunks: kept in results.jsonl, retried on the next run
+STATUS_INCOMPLETE = "incomplete"
+
+
+def iter_pdfs(root):
+    """PDF paths under `root` in a stable order."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(".pdf"):
+                yield os.path.join(dirpath, name)
+
+
+def load_manifest(path):
+    """sha256 -> latest manifest record. A torn last line (killed run) is ignored."""
+    manifest = {}
+    if not os.path.exists(path):
+        return manifest
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            manifest[record["sha256"]] = record
+    return manifest
+
+
+def _append_line(f, record):
+    f.write(json.dumps(record) + "\n")
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def _split_document(path, output_dir):
+    """Process pool task: split one PDF and return its page texts with the outputs."""
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    text_pdf, images_pdf, page_texts = split_pdf(path, output_folder=output_dir, with_text=True)
+    return text_pdf, images_pdf, page_texts, time.perf_counter() - start
+
+
+def _extract_document(page_texts, text_pdf, use_cache, concurrency):
+    """Thread pool task: entity extraction for one split document."""
+    from tinyllama_service import extract_entities_ollama
+    start = time.perf_counter()
+    result = extract_entities_ollama(text_pdf, concurrency=concurrency, use_cache=use_cache, pages=page_texts)
+    return result, time.perf_counter() - start
+
+
+def run_batch(input_dir, output_dir, split_workers=4, llm_concurrency=2, documents=2, use_cache=True):
+    """
+    Processes every PDF under `input_dir` that the manifest does not already
+    mark as done with the current settings. Returns a summary dict.
+    """
+    from tinyllama_service import extraction_complete, extraction_fingerprint
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    manifest = load_manifest(manifest_path)
+    fingerprint = extraction_fingerprint(text_source="pymupdf")
+
+    # Total LLM calls in flight = documents extracted at once x chunks per document
+    documents = max(1, min(documents, llm_concurrency))
+    per_document = max(1, llm_concurrency // documents)
+    summary = {"found": 0, "skipped": 0, STATUS_DONE: 0, STATUS_INCOMPLETE: 0, STATUS_FAILED: 0}
+    start = time.perf_counter()
+
+    def pending_documents():
+        claimed = set()
+        for path in iter_pdfs(input_dir):
+            summary["found"] += 1
+            sha256 = file_sha256(path)
+            key = DocumentCache.make_key(sha256, fingerprint)
+            record = manifest.get(sha256)
+            if sha256 in claimed or (record and record["status"] == STATUS_DONE and record["key"] == key):
+                summary["skipped"] += 1
+                continue
+            claimed.add(sha256)
+            yield path, sha256, key
+
+    print(f"Batch: {input_dir} -> {output_dir} (split workers={split_workers}, "
+          f"LLM concurrency={per_document * documents} over {documents} documents)")
+
+    # Spawned workers: the parent runs extraction threads, which fork() must not copy
+    spawn = multiprocessing.get_context("spawn")
+    with open(manifest_path, "a", encoding="utf-8") as manifest_file, \
+            open(os.path.join(output_dir, RESULTS_FILE), "a", encoding="utf-8") as results_file, \
+            ProcessPoolExecutor(max_workers=split_workers, mp_context=spawn) as splitters, \
+            ThreadPoolExecutor(max_workers=documents) as extractors:
+
+        def finish(doc, status, result=None, error=None):
+            path, sha256, key = doc["path"], doc["sha256"], doc["key"]
+            line = {
+                "path": os.path.relpath(path, input_dir),
+                "sha256": sha256,
+                "status": status,
+                "pages": doc.get("pages"),
+                "text_pdf": doc.get("text_pdf"),
+                "images_pdf": doc.get("images_pdf"),
+                "split_seconds": round(doc.get("split_seconds", 0.0), 2),
+                "extract_seconds": round(doc.get("extract_seconds", 0.0), 2),
+            }
+            if error is not None:
+                line["error"] = error
+            else:
+                line["result"] = result
+            # The result line goes first: a document is only "done" once its result is on disk
+            _append_line(results_file, line)
+            _append_line(manifest_file, {"sha256": sha256, "key": key, "path": line["path"], "status": status,
+                                         "output_dir": doc["output_dir"], "finished_at": time.time()})
+            summary[status] += 1
+            print(f"[{summary['done'] + summary['incomplete'] + summary['failed']}] {status}: {line['path']}"
+                  + (f" ({error})" if error else f" ({line['pages']} pages)"))
+
+        queue = pending_documents()
+        in_flight = {}   # future -> (stage, doc)
+        # Split a little ahead of extraction, but keep page texts in memory for a few documents only
+        max_in_flight = split_workers + 2 * documents
+
+        def refill():
+            while len(in_flight) < max_in_flight:
+                try:
+                    path, sha256, key = next(queue)
+                except StopIteration:
+                    return
+                doc = {"path": path, "sha256": sha256, "key": key,
+                       "output_dir": os.path.join(output_dir, sha256[:16])}
+                in_flight[splitters.submit(_split_document, path, doc["output_dir"])] = ("split", doc)
+
+        refill()
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, doc = in_flight.pop(future)
+                try:
+                    if stage == "split":
+                        text_pdf, images_pdf, page_texts, doc["split_seconds"] = future.result()
+                        doc.update(text_pdf=text_pdf, images_pdf=images_pdf, pages=len(page_texts))
+                        in_flight[extractors.submit(_extract_document, page_texts, text_pdf, use_cache,
+                                                    per_document)] = ("extract", doc)
+                    else:
+                        result, doc["extract_seconds"] = future.result()
+                        if "error" in result:
+                            finish(doc, STATUS_FAILED, error=result["error"])
+                        elif not extraction_complete(result):
+                            finish(doc, STATUS_INCOMPLETE, result=result)
+                        else:
+                            finish(doc, STATUS_DONE, result=result)
+                except Exception as e:
+                    finish(doc, STATUS_FAILED, error=f"{stage}: {e}")
+            refill()
+
+    summary["seconds"] = round(time.perf_counter() - start, 1)
+    print(f"Batch finished: {summary['done']} done, {summary['incomplete']} incomplete, {summary['failed']} failed, "
+          f"{summary['skipped']} already done, {summary['found']} PDFs in {summary['seconds']}s")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--split-workers", type=int, default=os.cpu_count() or 1,
+                        help="processes running split_pdf (default: CPU count)")
+    parser.add_argument("--llm-concurrency", type=int, default=None,
+                        help="LLM calls in flight across all documents (default: OLLAMA_CONCURRENCY)")
+    parser.add_argument("--documents", type=int, default=2, help="documents extracted at the same time")
+    parser.add_argument("--no-cache", action="store_true", help="do not use the per-chunk result cache")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.input_dir):
+        print(f"Not a directory: {args.input_dir}")
+        sys.exit(1)
+    from tinyllama_service import OLLAMA_CONCURRENCY
+    summary = run_batch(args.input_dir, args.output_dir, split_workers=max(1, args.split_workers),
+                        llm_concurrency=max(1, args.llm_concurrency or OLLAMA_CONCURRENCY),
+                        documents=args.documents, use_cache=not args.no_cache)
+    sys.exit(1 if summary["failed"] or summary["incomplete"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Chunker comparison: the character splitter vs the token/structure-aware one.
+
+For each PDF the page text is read with PyMuPDF (as the /upload_split
+pipeline does) and chunked by both strategies. Reported per strategy:
+chunk count (= LLM calls), chunk tokens, total prompt tokens including the
+system prompt, and the tokens sent more than once compared to the
+document's own text.
+
+Usage (from the repository root):
+    python benchmarks/chunking_benchmark.py file.pdf [more.pdf ...] [--output report.json]
+"""
+import argparse
+import json
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import fitz
+
+from chunking import get_token_counter
+from tinyllama_service import iter_document_chunks
+
+STRATEGIES = ("characters", "structured")
+
+
+def compare(path, count_tokens):
+    with fitz.open(path) as doc:
+        pages = [page.get_text() for page in doc]
+    document_tokens = sum(count_tokens(page) for page in pages)
+
+    report = {"pdf": path, "pages": len(pages), "document_tokens": document_tokens}
+    for strategy in STRATEGIES:
+        stats = {}
+        for _ in iter_document_chunks(iter(pages), stats, strategy=strategy):
+            pass
+        stats["resent_tokens"] = max(0, stats["chunk_tokens"] - document_tokens)
+        report[strategy] = stats
+
+    before, after = report["characters"], report["structured"]
+    if before["chunks"]:
+        report["llm_calls_saved_pct"] = round(100.0 * (1 - after["chunks"] / before["chunks"]), 1)
+        report["prompt_tokens_saved_pct"] = round(100.0 * (1 - after["prompt_tokens"] / before["prompt_tokens"]), 1)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="+")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    count_tokens, tokenizer_name = get_token_counter()
+    report = {
+        "tokenizer": tokenizer_name,
+        "documents": [compare(path, count_tokens) for path in args.pdfs],
+    }
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
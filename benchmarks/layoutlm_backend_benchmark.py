@@ -0,0 +1,148 @@
+"""
+LayoutLMv3 inference backend benchmark: fp32 PyTorch vs int8 / ONNX Runtime.
+
+Every page of the sample PDFs is encoded once (text-layer words, sliding
+windows for long pages) and then run through each backend, all built from
+the same fp32 weights so their predictions are comparable. Reported per
+backend:
+
+  - latency: per-page forward pass at batch size 1 (median / p95 ms)
+  - throughput: pages per second through run_batched_inference()
+  - agreement: share of real (non-padding) tokens whose argmax label
+    matches the fp32 model, and the largest absolute logit difference
+
+Usage (from the repository root):
+    python benchmarks/layoutlm_backend_benchmark.py [--backends torch,int8,onnx,onnx-int8]
+        [--runs 5] [--batch 8] [--model-id microsoft/layoutlmv3-base] [--output report.json]
+"""
+import argparse
+import copy
+import glob
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(REPO_ROOT, "ml_prototype"))
+
+import fitz
+import torch
+from transformers import LayoutLMv3ForTokenClassification, LayoutLMv3Processor
+
+from batch_inference import run_batched_inference
+from inference_backends import BACKENDS, BACKEND_TORCH, build_backend
+from layoutlmv3_extractor import LABELS_MAP, MODEL_ID, encode_page_windows, page_words, render_page
+
+DEFAULT_PDFS = os.path.join(REPO_ROOT, "ml_prototype", "sample_*.pdf")
+
+
+def encode_pdfs(paths, processor):
+    encodings = []
+    for path in paths:
+        with fitz.open(path) as doc:
+            for page in doc:
+                words, boxes = page_words(page)
+                if words:
+                    encodings.append(encode_page_windows(render_page(page), words, boxes, processor))
+    return encodings
+
+
+def measure(model, encodings, runs, batch):
+    # Warm-up pass (ONNX Runtime and oneDNN pick kernels on the first call)
+    run_batched_inference(model, encodings[:1])
+
+    latencies = []
+    for _ in range(runs):
+        for encoding in encodings:
+            start = time.perf_counter()
+            run_batched_inference(model, [encoding])
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        logits = run_batched_inference(model, encodings, max_batch_rows=batch)
+    batched_seconds = (time.perf_counter() - start) / runs
+
+    latencies.sort()
+    return logits, {
+        "latency_ms_median": round(statistics.median(latencies) * 1000.0, 2),
+        "latency_ms_p95": round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] * 1000.0, 2),
+        "throughput_pages_per_s": round(len(encodings) / batched_seconds, 2),
+    }
+
+
+def agreement(encodings, logits, reference):
+    matched = total = 0
+    max_diff = 0.0
+    for encoding, ours, ref in zip(encodings, logits, reference):
+        mask = encoding["attention_mask"].bool()
+        matched += (ours.argmax(-1) == ref.argmax(-1))[mask].sum().item()
+        total += mask.sum().item()
+        max_diff = max(max_diff, (ours - ref).abs().max().item())
+    return {
+        "argmax_agreement": round(matched / total, 4) if total else None,
+        "max_abs_logit_diff": round(max_diff, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="*", help="PDFs to benchmark (default: ml_prototype/sample_*.pdf)")
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--batch", type=int, default=8, help="max rows per batch for the throughput run")
+    parser.add_argument("--model-id", default=MODEL_ID, help="hub id or local directory")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    paths = args.pdfs or sorted(glob.glob(DEFAULT_PDFS))
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    if BACKEND_TORCH not in backends:
+        backends.insert(0, BACKEND_TORCH)
+
+    fp32 = LayoutLMv3ForTokenClassification.from_pretrained(args.model_id, num_labels=len(LABELS_MAP)).eval()
+    processor = LayoutLMv3Processor.from_pretrained(args.model_id, apply_ocr=False)
+    encodings = encode_pdfs(paths, processor)
+    if not encodings:
+        sys.exit("No pages with text found in the given PDFs.")
+
+    report = {
+        "pdfs": [os.path.relpath(p, REPO_ROOT) for p in paths],
+        "pages": len(encodings),
+        "windows": sum(e["input_ids"].shape[0] for e in encodings),
+        "torch_threads": torch.get_num_threads(),
+        "backends": {},
+    }
+    reference = None
+    with tempfile.TemporaryDirectory() as export_dir:
+        for backend in backends:
+            start = time.perf_counter()
+            # Fresh export per run: the ONNX models must carry the same weights as fp32
+            model = build_backend(copy.deepcopy(fp32), backend,
+                                  onnx_path=os.path.join(export_dir, "layoutlmv3.onnx"))
+            build_seconds = time.perf_counter() - start
+
+            logits, result = measure(model, encodings, args.runs, args.batch)
+            if reference is None:
+                reference = logits
+            result["build_s"] = round(build_seconds, 2)
+            result.update(agreement(encodings, logits, reference))
+            report["backends"][backend] = result
+            print(f"{backend}: {result}", file=sys.stderr)
+
+    baseline = report["backends"][BACKEND_TORCH]
+    for result in report["backends"].values():
+        result["speedup_vs_fp32"] = round(baseline["latency_ms_median"] / result["latency_ms_median"], 2)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Stage-level extraction benchmark on a synthetic corpus with a mock LLM.
+
+Builds control narratives of the requested page counts (cover page,
+sections with steps, If/then logic, tag tables, a shared logo and one
+diagram image per page) with ml_prototype/generate_samples.py, then runs
+each one through the /upload_split stages:
+
+    split       split_pdf -> text_only.pdf + images_only.pdf
+    text        page text from the source PDF (PyMuPDF)
+    extraction  extract_entities_ollama(pages=...) against mock_ollama (fixed
+                latency per call): chunking, tag pre-scan, LLM calls, ordered
+                merge and dedup, as the app runs them. Its chunking and dedup
+                time and the summed LLM call time come from the pipeline's
+                own stage metrics; the chunking, tag and llm_timing reports
+                are the ones the extraction returns. The one-off tokenizer
+                load is timed separately as tokenizer_load.
+
+Each document runs in a fresh interpreter, so peak RSS is not inflated by
+earlier documents. Per stage the report gives wall time, the process peak
+RSS at the end of the stage (a high-water mark, so the stage where it jumps
+is the one that allocated) and throughput in pages or chunks per second.
+No Ollama, GPU or network is needed.
+
+Usage (from the repository root):
+    python benchmarks/pipeline_benchmark.py [--pages 1 10 100 1000] [--latency-ms 20]
+                                            [--concurrency 2] [--split-workers 0] [--no-images]
+                                            [--output report.json]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+CORPUS_DIR = os.path.join(REPO_ROOT, "benchmarks", "corpus")
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux (bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def build_corpus(page_counts, images, seed):
+    """Generates (or reuses) one synthetic narrative per page count."""
+    sys.path.insert(0, os.path.join(REPO_ROOT, "ml_prototype"))
+    from generate_samples import create_narrative
+
+    os.makedirs(CORPUS_DIR, exist_ok=True)
+    paths = []
+    for pages in page_counts:
+        name = f"narrative_{pages}p_seed{seed}{'' if images else '_noimg'}.pdf"
+        path = os.path.join(CORPUS_DIR, name)
+        if not os.path.exists(path):
+            start = time.perf_counter()
+            create_narrative(path + ".tmp", pages, seed=seed, images=images)
+            os.replace(path + ".tmp", path)
+            print(f"Generated {name} in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+        paths.append(path)
+    return paths
+
+
+def run_document(pdf_path, latency_ms, concurrency, split_workers=0):
+    """Runs every stage on one PDF in this process and returns the stage report."""
+    import fitz
+
+    import metrics
+    from chunking import get_token_counter
+    from mock_ollama import MockOllamaServer
+    from split_pdf import split_pdf
+
+    report = {"pdf": os.path.relpath(pdf_path, REPO_ROOT), "size_mb": round(os.path.getsize(pdf_path) / 1e6, 2),
+              "baseline_rss_mb": peak_rss_mb(), "stages": {}}
+
+    def record(stage, start, units, unit_name):
+        seconds = time.perf_counter() - start
+        report["stages"][stage] = {
+            "seconds": round(seconds, 4),
+            "peak_rss_mb": peak_rss_mb(),
+            unit_name: units,
+            f"{unit_name}_per_s": round(units / seconds, 1) if seconds > 0 else None,
+        }
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        start = time.perf_counter()
+        split_pdf(pdf_path, output_folder=output_dir, workers=split_workers)
+        with fitz.open(pdf_path) as doc:
+            num_pages = len(doc)
+        record("split", start, num_pages, "pages")
+
+    start = time.perf_counter()
+    with fitz.open(pdf_path) as doc:
+        pages = [page.get_text() for page in doc]
+    record("text", start, num_pages, "pages")
+
+    # Loading the tokenizer (and transformers) is a one-off per process,
+    # kept out of the extraction numbers
+    start = time.perf_counter()
+    get_token_counter()
+    report["tokenizer_load"] = {"seconds": round(time.perf_counter() - start, 4), "peak_rss_mb": peak_rss_mb()}
+
+    with MockOllamaServer(latency_ms=latency_ms) as server:
+        # This process only talks to the mock server
+        os.environ["OLLAMA_HOST"] = server.url
+        from tinyllama_service import CATEGORIES, extract_entities_ollama
+
+        before = {stage: metrics.STAGE_SECONDS.snapshot(stage=stage)[1] for stage in ("chunking", "llm_call", "dedup")}
+        start = time.perf_counter()
+        result = extract_entities_ollama(pdf_path, concurrency=concurrency, use_cache=False, pages=pages)
+        record("extraction", start, result["chunking"]["chunks"], "chunks")
+        calls = len(server.requests)
+    if "error" in result:
+        raise RuntimeError(f"Extraction failed: {result['error']}")
+
+    stage = report["stages"]["extraction"]
+    for name, seconds in before.items():
+        # llm_call is summed over calls, so with concurrency > 1 it exceeds the wall time
+        stage[f"{name}_seconds"] = round(metrics.STAGE_SECONDS.snapshot(stage=name)[1] - seconds, 4)
+    stage["calls"] = calls
+    stage["unique_items"] = sum(len(result[category]) for category in CATEGORIES)
+    report["chunking"] = result["chunking"]
+    if "tags" in result:
+        report["tags"] = {key: value for key, value in result["tags"].items() if key != "index"}
+    report["llm_timing"] = result["llm_timing"]
+
+    report["pages"] = num_pages
+    report["total_seconds"] = round(sum(stage["seconds"] for stage in report["stages"].values()), 4)
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+
+def run_child(pdf_path, latency_ms, concurrency, split_workers):
+    args = [sys.executable, os.path.abspath(__file__), "--run-document", pdf_path,
+            "--latency-ms", str(latency_ms), "--concurrency", str(concurrency),
+            "--split-workers", str(split_workers)]
+    proc = subprocess.run(args, cwd=REPO_ROOT, capture_output=True, text=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+    raise RuntimeError(f"Benchmark child failed for {pdf_path}:\n{proc.stdout[-2000:]}\n{proc.stderr[-2000:]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="mock LLM latency per call")
+    parser.add_argument("--concurrency", type=int, default=2, help="chunks in flight against the mock LLM")
+    parser.add_argument("--split-workers", type=int, default=0,
+                        help="worker processes for page-parallel split_pdf (0 = serial)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-images", action="store_true")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--run-document", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_document:
+        result = run_document(args.run_document, args.latency_ms, args.concurrency, args.split_workers)
+        print("RESULT " + json.dumps(result))
+        return
+
+    report = {
+        "latency_ms": args.latency_ms,
+        "concurrency": args.concurrency,
+        "split_workers": args.split_workers,
+        "images": not args.no_images,
+        "documents": [run_child(path, args.latency_ms, args.concurrency, args.split_workers)
+                      for path in build_corpus(args.pages, not args.no_images, args.seed)],
+    }
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
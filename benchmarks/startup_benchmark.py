@@ -0,0 +1,79 @@
+"""
+Startup benchmark: time-to-first-request for the splitter page.
+
+Each run starts a fresh interpreter, imports app.py and serves GET / through
+Flask's test client, reporting how long the import and the first response
+took. With --wait-ready it also reports when /ready turns 200, i.e. when the
+LayoutLMv3 model finished loading in the background.
+
+Usage (from the repository root):
+    python benchmarks/startup_benchmark.py [--runs 5] [--wait-ready] [--no-model]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD_SCRIPT = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import app
+t_import = time.perf_counter()
+client = app.app.test_client()
+response = client.get('/')
+t_first = time.perf_counter()
+result = {
+    "import_s": t_import - t0,
+    "first_request_s": t_first - t0,
+    "first_status": response.status_code,
+}
+if "--wait-ready" in sys.argv:
+    app.layoutlm.wait()
+    result["ready_s"] = time.perf_counter() - t0
+    result["ready_status"] = client.get('/ready').status_code
+print("RESULT " + json.dumps(result))
+"""
+
+
+def run_once(wait_ready, no_model):
+    env = dict(os.environ)
+    if no_model:
+        env["LOAD_LAYOUTLM"] = "0"
+    args = [sys.executable, "-c", CHILD_SCRIPT] + (["--wait-ready"] if wait_ready else [])
+    start = time.perf_counter()
+    proc = subprocess.run(args, cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    for line in proc.stdout.splitlines():
+        if line.startswith("RESULT "):
+            result = json.loads(line[len("RESULT "):])
+            result["process_wall_s"] = wall
+            return result
+    raise RuntimeError(f"Benchmark child failed:\n{proc.stdout}\n{proc.stderr}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--wait-ready", action="store_true", help="also time background model readiness")
+    parser.add_argument("--no-model", action="store_true", help="run with LOAD_LAYOUTLM=0 (splitter only)")
+    args = parser.parse_args()
+
+    runs = [run_once(args.wait_ready, args.no_model) for _ in range(args.runs)]
+    summary = {"runs": args.runs}
+    for key in runs[0]:
+        values = [r[key] for r in runs]
+        if key.endswith("_s"):
+            summary[key] = {"median": round(statistics.median(values), 3),
+                            "min": round(min(values), 3), "max": round(max(values), 3)}
+        else:
+            summary[key] = values[-1]
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
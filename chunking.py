@@ -0,0 +1,427 @@
+"""
+Streaming text pipeline for extraction: PDF pages -> text chunks.
+
+Both stages are generators, so the first chunk can go to the LLM while the
+rest of the document is still being read, and only a few chunks worth of
+text is held in memory regardless of document length.
+"""
+import os
+import re
+import threading
+
+from tags import TAG_RE
+
+# Split the buffered text once it holds this many chunks worth of characters
+FLUSH_FACTOR = 4
+
+
+def iter_pdf_pages(pdf_path):
+    """Yields the extracted text of each page of the PDF, one page at a time."""
+    from pypdf import PdfReader
+    reader = PdfReader(pdf_path)
+    for page in reader.pages:
+        yield page.extract_text() or ""
+
+
+def iter_chunks(pages, chunk_size, chunk_overlap):
+    """
+    Incrementally chunks a stream of page texts.
+
+    Uses RecursiveCharacterTextSplitter on a rolling buffer: whenever the
+    buffer is large enough, every chunk but the last is emitted and the
+    last one (which already carries the overlap) starts the next buffer.
+    Falls back to fixed-size slicing when langchain is not installed.
+    """
+    try:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            separators=["\n\n", "\n", ".", " ", ""]
+        )
+    except ImportError:
+        # Fallback if langchain.text_splitter is not available
+        print("RecursiveCharacterTextSplitter not found, using simple slicing.")
+        yield from _iter_sliced_chunks(pages, chunk_size, chunk_overlap)
+        return
+
+    buffer = ""
+    for page_text in pages:
+        buffer += page_text + "\n"
+        if len(buffer) < FLUSH_FACTOR * chunk_size:
+            continue
+        chunks = text_splitter.split_text(buffer)
+        yield from chunks[:-1]
+        buffer = chunks[-1] + "\n" if chunks else ""
+
+    if buffer.strip():
+        yield from text_splitter.split_text(buffer)
+
+
+def _iter_sliced_chunks(pages, chunk_size, chunk_overlap):
+    buffer = ""
+    for page_text in pages:
+        buffer += page_text + "\n"
+        # Emit full windows; keep the overlap (and any partial window) buffered
+        while len(buffer) > chunk_size:
+            yield buffer[:chunk_size]
+            buffer = buffer[chunk_size - chunk_overlap:]
+
+    if buffer.strip():
+        yield buffer
+
+
+# --- Token-aware, structure-aware chunking ---
+#
+# iter_chunks() above cuts every CHUNK_SIZE characters and re-sends a fixed
+# overlap with every chunk. The functions below size chunks in model tokens
+# and cut at narrative structure instead: the page text is read as a stream
+# of blocks (section headings, numbered steps, If/Else logic blocks, tag
+# tables, paragraphs) which are packed whole into chunks. Text is only
+# repeated where a block has to be cut: the section heading is carried into
+# the next chunk, an open condition ("If ... then") moves with its actions,
+# a split table repeats its header line and an oversized sentence is windowed
+# with a small token overlap.
+
+# Hugging Face tokenizer used for token counts (hub id or local directory).
+# Loaded from the local cache only unless CHUNK_TOKENIZER_DOWNLOAD=1;
+# without it token counts are estimated.
+CHUNK_TOKENIZER = os.environ.get("CHUNK_TOKENIZER", "microsoft/Phi-3-mini-4k-instruct")
+CHUNK_TOKENIZER_DOWNLOAD = os.environ.get("CHUNK_TOKENIZER_DOWNLOAD", "0") == "1"
+
+# A chunk that is this full when a new section starts is flushed first
+SECTION_FLUSH_RATIO = 0.75
+
+BLOCK_HEADING = "heading"
+BLOCK_TABLE = "table"
+BLOCK_TEXT = "text"
+
+# "2.5.2.3.1  Startup command sequence", "3. OPERATION", "SECTION 4 Alarms"
+HEADING_RE = re.compile(
+    r"^(?:\d+(?:\.\d+)+\.?|\d+\.?)\s+[A-Z][^.]{0,80}$"
+    r"|^(?:SECTION|Section|CHAPTER|Chapter)\s+\d+\b.{0,80}$"
+)
+# Numbered steps and bullets: "1.", "2)", "a)", "Step 3", "•"
+STEP_RE = re.compile(r"^(?:\d{1,2}[.)]|[a-z][.)]|Step\s+\d+\b|[•▪●◦\-*])\s*")
+# Lines that open a logic block
+LOGIC_RE = re.compile(r"^(?:If|Else|ElseIf|Otherwise|When|While|Whenever|Once|Upon)\b")
+SENTENCE_END_RE = re.compile(r"[.!?;]\s*$")
+SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?;])\s+")
+# Estimator pieces: words, single digits (Llama tokenizers split numbers
+# into digits) and individual punctuation characters
+ESTIMATE_RE = re.compile(r"[A-Za-z]+|\d|[^\sA-Za-z\d]")
+
+TABLE_ROW_MAX_CHARS = 60
+
+# Running headers/footers: lines checked at each end of a page, and on how
+# many pages such a line must repeat before it is dropped
+EDGE_LINES = 3
+RUNNING_LINE_MIN_PAGES = 3
+# Free-standing numbers (page numbers, "3 of 40"); digits joined to a tag
+# (P-101, SV01) or a section number (2.5.1) are part of the line's identity
+PAGE_NUMBER_RE = re.compile(r"(?<![\w-])(?<!\d\.)\d+(?![\w-]|\.\d)")
+
+_token_counter = None
+_token_counter_lock = threading.Lock()
+
+
+def get_token_counter():
+    """
+    Returns (count_tokens, name): the model tokenizer if it can be loaded,
+    otherwise a character-class estimate tuned for Llama-style tokenizers.
+    """
+    global _token_counter
+    # Locked: documents chunked concurrently must not race the (slow) first import
+    with _token_counter_lock:
+        if _token_counter is None:
+            try:
+                from transformers import AutoTokenizer
+                tokenizer = AutoTokenizer.from_pretrained(CHUNK_TOKENIZER,
+                                                          local_files_only=not CHUNK_TOKENIZER_DOWNLOAD)
+                _token_counter = (lambda text: len(tokenizer.encode(text, add_special_tokens=False)),
+                                  CHUNK_TOKENIZER)
+            except Exception as e:
+                print(f"Tokenizer '{CHUNK_TOKENIZER}' unavailable ({type(e).__name__}), estimating token counts.")
+                _token_counter = (estimate_tokens, "estimate")
+        return _token_counter
+
+
+def estimate_tokens(text):
+    tokens = 0
+    for piece in ESTIMATE_RE.findall(text):
+        tokens += max(1, round(len(piece) / 4)) if piece[0].isalpha() else 1
+    return tokens
+
+
+def iter_structured_chunks(pages, max_tokens, overlap_tokens, count_tokens=None):
+    """
+    Incrementally chunks a stream of page texts by structure and token
+    budget (see the comment above). Like iter_chunks, it only buffers the
+    current chunk and block, never the whole document.
+    """
+    if count_tokens is None:
+        count_tokens, _ = get_token_counter()
+
+    parts = []        # [(kind, text, tokens)] of the chunk being built
+    used = 0
+    heading = None    # (text, tokens) of the current section heading
+
+    def has_content():
+        return any(kind != BLOCK_HEADING for kind, _, _ in parts)
+
+    def flush():
+        nonlocal parts, used
+        text = "\n".join(text for _, text, _ in parts)
+        parts, used = [], 0
+        return text
+
+    def start_chunk(carry=()):
+        # A chunk starting mid-section gets the section heading for context
+        nonlocal used
+        if heading and not (carry and carry[0][0] == BLOCK_HEADING):
+            parts.append((BLOCK_HEADING, heading[0], heading[1]))
+            used += heading[1]
+        for part in carry:
+            parts.append(part)
+            used += part[2]
+
+    for kind, text in _iter_blocks(pages):
+        tokens = count_tokens(text)
+
+        if kind == BLOCK_HEADING:
+            if has_content() and used >= SECTION_FLUSH_RATIO * max_tokens:
+                yield flush()
+            heading = (text, tokens)
+            if used + tokens > max_tokens and has_content():
+                yield flush()
+            parts.append((kind, text, tokens))
+            used += tokens
+            continue
+
+        if used + tokens <= max_tokens:
+            parts.append((kind, text, tokens))
+            used += tokens
+            continue
+
+        heading_tokens = heading[1] if heading else 0
+        if tokens + heading_tokens <= max_tokens:
+            # The block does not fit here but does in a fresh chunk: close the
+            # chunk at the previous block. An open condition at the end moves
+            # along with its actions.
+            carry = []
+            if len(parts) > 1 and parts[-1][0] == BLOCK_TEXT and _is_open_logic(parts[-1][1]):
+                carry = [parts.pop()]
+                used -= carry[0][2]
+            if has_content():
+                yield flush()
+            else:
+                # Only stacked headings so far: keep just the innermost one
+                parts, used = [], 0
+            start_chunk(carry)
+            parts.append((kind, text, tokens))
+            used += tokens
+            continue
+
+        # Too large for any chunk: cut the block itself, filling the current
+        # chunk first unless it is nearly full
+        if has_content() and max_tokens - used < max_tokens // 4:
+            yield flush()
+            start_chunk()
+        pieces = _split_block(kind, text, max_tokens - used, max_tokens - heading_tokens,
+                              overlap_tokens, count_tokens)
+        for i, piece in enumerate(pieces):
+            piece_tokens = count_tokens(piece)
+            # The first piece may still not fit (e.g. one long sentence)
+            if i or (used + piece_tokens > max_tokens and has_content()):
+                yield flush()
+                start_chunk()
+            parts.append((kind, piece, piece_tokens))
+            used += piece_tokens
+
+    if has_content():
+        yield flush()
+
+
+def _is_open_logic(text):
+    last = text.rstrip().splitlines()[-1].rstrip().lower()
+    return bool(LOGIC_RE.match(text.lstrip())) and (last.endswith("then") or last.endswith(":")
+                                                     or last.endswith(","))
+
+
+def _split_block(kind, text, first_budget, budget, overlap_tokens, count_tokens):
+    """
+    Cuts one oversized block into pieces: tables at row boundaries (header
+    line repeated), text at sentence boundaries, and single sentences longer
+    than the budget into overlapping word windows.
+    """
+    if kind == BLOCK_TABLE:
+        header, *rows = text.splitlines()
+        units = [header + "\n" + row for row in rows] if rows else [header]
+        return _pack_units(units, first_budget, budget, count_tokens,
+                           joiner="\n", strip_prefix=header + "\n")
+
+    units = []
+    for sentence in SENTENCE_SPLIT_RE.split(text):
+        if count_tokens(sentence) <= budget:
+            units.append(sentence)
+        else:
+            units.extend(_word_windows(sentence, budget, overlap_tokens, count_tokens))
+    return _pack_units(units, first_budget, budget, count_tokens, joiner=" ")
+
+
+def _pack_units(units, first_budget, budget, count_tokens, joiner, strip_prefix=None):
+    pieces = []
+    current, current_tokens = [], 0
+    limit = max(first_budget, 1)
+    for unit in units:
+        # Table rows carry the header; only the first row of a piece keeps it
+        body = unit[len(strip_prefix):] if strip_prefix and current else unit
+        unit_tokens = count_tokens(body)
+        if current and current_tokens + unit_tokens > limit:
+            pieces.append(joiner.join(current))
+            current, current_tokens, limit = [], 0, budget
+            body, unit_tokens = unit, count_tokens(unit)
+        current.append(body)
+        current_tokens += unit_tokens
+    if current:
+        pieces.append(joiner.join(current))
+    return pieces
+
+
+def _word_windows(sentence, budget, overlap_tokens, count_tokens):
+    words = sentence.split()
+    windows = []
+    start = 0
+    while start < len(words):
+        end = start
+        tokens = 0
+        while end < len(words) and (tokens + count_tokens(words[end]) <= budget or end == start):
+            tokens += count_tokens(words[end])
+            end += 1
+        windows.append(" ".join(words[start:end]))
+        if end >= len(words):
+            break
+        # Step back far enough to repeat ~overlap_tokens of context
+        back, back_tokens = end, 0
+        while back > start + 1 and back_tokens < overlap_tokens:
+            back -= 1
+            back_tokens += count_tokens(words[back])
+        start = back
+    return windows
+
+
+def _iter_blocks(pages):
+    """Yields (kind, text) blocks from a stream of page texts."""
+    lines = []
+    kind = None
+
+    def emit():
+        nonlocal lines, kind
+        block_kind = kind
+        if block_kind == BLOCK_TABLE and len(lines) < 3:
+            block_kind = BLOCK_TEXT
+        block = (block_kind, "\n".join(lines))
+        lines, kind = [], None
+        return block
+
+    pending_bullet = None
+    for line in _iter_lines(pages):
+        if not line:
+            if lines:
+                yield emit()
+            continue
+        if STEP_RE.fullmatch(line):
+            # A bullet on its own line belongs to the next line's text
+            pending_bullet = line
+            continue
+        if pending_bullet:
+            line = f"{pending_bullet} {line}"
+            pending_bullet = None
+
+        if HEADING_RE.match(line):
+            if lines:
+                yield emit()
+            yield BLOCK_HEADING, line
+            continue
+
+        # Short lines with a tag are table rows, except as the actions of a logic block
+        in_logic = kind == BLOCK_TEXT and LOGIC_RE.match(lines[0]) is not None
+        is_row = (not in_logic and not LOGIC_RE.match(line)
+                  and len(line) <= TABLE_ROW_MAX_CHARS and TAG_RE.search(line) is not None)
+        if kind == BLOCK_TABLE:
+            if is_row or len(line) <= TABLE_ROW_MAX_CHARS // 2:
+                lines.append(line)
+                continue
+            yield emit()
+
+        starts_block = (STEP_RE.match(line) or LOGIC_RE.match(line)
+                        or (lines and SENTENCE_END_RE.search(lines[-1]) and line[:1].isupper()))
+        if is_row and (not lines or starts_block or len(lines[-1]) <= TABLE_ROW_MAX_CHARS):
+            # Short tag lines in a row form a table; the line before is its header
+            header = lines[-1:] if lines and len(lines[-1]) <= TABLE_ROW_MAX_CHARS else []
+            if lines[:-1] if header else lines:
+                lines = lines[:-1] if header else lines
+                yield emit()
+            lines, kind = header + [line], BLOCK_TABLE
+            continue
+        if lines and starts_block:
+            yield emit()
+        lines.append(line)
+        kind = kind or BLOCK_TEXT
+
+    if pending_bullet:
+        lines.append(pending_bullet)
+    if lines:
+        yield emit()
+
+
+def _iter_lines(pages):
+    """
+    Stripped lines of every page, with blank lines marking paragraph breaks.
+    Running headers/footers are dropped so they are not sent per chunk: a
+    line among the first or last EDGE_LINES of a page is one when the same
+    line sits at the edge of at least RUNNING_LINE_MIN_PAGES pages so far
+    (the first pages are read ahead to decide for them too). Only free-
+    standing numbers are ignored in the comparison ("Page 3 of 40"), so
+    section numbers and tags keep lines such as "2.5.2.3.1 Startup" and
+    "2.5.2.3.2 Startup" or P-101 and P-102 apart.
+    """
+    pages = iter(pages)
+    edge_counts = {}
+    lookahead = []
+    for page_text in pages:
+        lookahead.append(_page_lines(page_text, edge_counts))
+        if len(lookahead) >= RUNNING_LINE_MIN_PAGES:
+            break
+
+    def page_lines():
+        yield from lookahead
+        for page_text in pages:
+            yield _page_lines(page_text, edge_counts)
+
+    for page, edges in page_lines():
+        content = [i for i, line in enumerate(page) if line]
+        first = 0
+        for i in content[:EDGE_LINES]:
+            if edge_counts[edges[i]] < RUNNING_LINE_MIN_PAGES:
+                break
+            first = i + 1
+        last = len(page)
+        for i in reversed([i for i in content if i >= first][-EDGE_LINES:]):
+            if edge_counts[edges[i]] < RUNNING_LINE_MIN_PAGES:
+                break
+            last = i
+        yield from page[first:last]
+        yield ""
+
+
+def _page_lines(page_text, edge_counts):
+    """Splits a page into stripped lines and counts its edge lines into edge_counts."""
+    page = [line.strip() for line in page_text.splitlines()]
+    content = [i for i, line in enumerate(page) if line]
+    edges = {}
+    for i in content[:EDGE_LINES] + content[-EDGE_LINES:]:
+        edges[i] = PAGE_NUMBER_RE.sub("#", page[i])
+    for key in set(edges.values()):
+        edge_counts[key] = edge_counts.get(key, 0) + 1
+    return page, edges
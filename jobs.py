@@ -0,0 +1,145 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Job lifecycle states
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """Raised when the queue already holds `max_pending` unfinished jobs."""
+
+
+class JobQueue:
+    """
+    Small in-process job runner backed by a bounded thread pool.
+
+    Work is submitted with `submit()` which returns a job id immediately; the
+    caller polls `get()` for the state and result. At most `max_workers` jobs
+    run at once and at most `max_pending` jobs may be queued or running, so a
+    burst of large uploads cannot pile up unbounded work on the server.
+    Finished jobs are kept for polling until `max_finished` newer ones have
+    completed.
+
+    Jobs submitted with `emit_events=True` receive an `emit(event, data)`
+    keyword argument to publish progress. `events()` replays and then
+    follows a job's events; a final "done" (with the result) or "failed"
+    (with the error) event is appended when the job finishes.
+    """
+
+    def __init__(self, max_workers=2, max_pending=16, max_finished=256):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._finished_order = []
+        self._events = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def submit(self, fn, *args, emit_events=False, **kwargs):
+        with self._lock:
+            pending = sum(1 for j in self._jobs.values() if j["status"] in (JOB_QUEUED, JOB_RUNNING))
+            if pending >= self.max_pending:
+                raise QueueFullError(f"{pending} jobs already pending")
+
+            job_id = str(uuid.uuid4())
+            self._jobs[job_id] = {
+                "id": job_id,
+                "status": JOB_QUEUED,
+                "submitted_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "result": None,
+                "error": None,
+            }
+            self._events[job_id] = []
+
+        if emit_events:
+            kwargs["emit"] = lambda event, data=None: self._emit(job_id, event, data)
+        self._executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def get(self, job_id):
+        """Returns a snapshot of the job record, or None if unknown/expired."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def events(self, job_id, after=0, heartbeat=15.0):
+        """
+        Yields (seq, event, data) for the job's events with seq > `after`,
+        waiting for new ones until the job has finished. While nothing
+        happens it yields None every `heartbeat` seconds so streaming
+        responses can keep the connection alive.
+        """
+        while True:
+            with self._changed:
+                log = self._events.get(job_id)
+                if log is None:
+                    return
+                if len(log) <= after:
+                    if self._jobs[job_id]["finished_at"] is not None:
+                        return
+                    self._changed.wait(heartbeat)
+                    log = self._events.get(job_id)
+                    if log is None:
+                        return
+                new = log[after:]
+            if not new:
+                yield None
+                continue
+            for event in new:
+                after += 1
+                yield (after,) + event
+
+    def stats(self):
+        with self._lock:
+            counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_DONE: 0, JOB_FAILED: 0}
+            for job in self._jobs.values():
+                counts[job["status"]] += 1
+        counts["max_workers"] = self.max_workers
+        counts["max_pending"] = self.max_pending
+        return counts
+
+    def _run(self, job_id, fn, args, kwargs):
+        self._update(job_id, status=JOB_RUNNING, started_at=time.time())
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            self._emit(job_id, JOB_FAILED, {"error": str(e)})
+            self._finish(job_id, status=JOB_FAILED, error=str(e))
+        else:
+            self._emit(job_id, JOB_DONE, result)
+            self._finish(job_id, status=JOB_DONE, result=result)
+
+    def _emit(self, job_id, event, data):
+        with self._changed:
+            log = self._events.get(job_id)
+            if log is not None:
+                log.append((event, data))
+                self._changed.notify_all()
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _finish(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields, finished_at=time.time())
+            self._finished_order.append(job_id)
+            # Forget the oldest finished jobs so the table stays bounded
+            while len(self._finished_order) > self.max_finished:
+                expired = self._finished_order.pop(0)
+                self._jobs.pop(expired, None)
+                self._events.pop(expired, None)
+            self._changed.notify_all()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,216 @@
+"""
+Process-wide pipeline metrics in the Prometheus text format.
+
+Counters and histograms are plain thread-safe objects in a module registry;
+`render()` produces the /metrics payload. Stage timings go through
+`span(stage)` (a block) or `timed_iter(stage, iterable)` (the time spent
+producing items of a lazy generator). Spans nest per thread and a stage
+only counts its own time: a split span that contains the page text read
+records the text read under "text_extraction", not under "split" too.
+"""
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds: from a cache lookup up to a long LLM call or a 1000-page split
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._samples(items))
+        return lines
+
+    def _samples(self, items):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        # Exposed as <name>_total, the Prometheus convention for counters
+        super().__init__(name + "_total", documentation, labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self, items):
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [per-bucket counts, sum, count]
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def snapshot(self, **labels):
+        """(count, sum) for one label set."""
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return (state[2], state[1]) if state else (0, 0.0)
+
+    def _samples(self, items):
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# === Pipeline metrics ===
+STAGE_SECONDS = Histogram(
+    "extraction_stage_seconds",
+    "Time spent per pipeline stage (upload_save, split, text_extraction, chunking, llm_call, dedup).",
+    ("stage",))
+LLM_ATTEMPTS = Counter(
+    "extraction_llm_attempts",
+    "LLM calls per chunk attempt by outcome (ok, collapse, reask, parse_failure, error).",
+    ("outcome",))
+LLM_PARSE = Counter(
+    "extraction_llm_parse",
+    "LLM replies by output format (schema, json, none) and parse outcome (valid, repaired, failed).",
+    ("format", "outcome"))
+LLM_RETRIES = Counter("extraction_llm_retries", "LLM calls repeated for the same chunk.")
+CHUNKS = Counter(
+    "extraction_chunks",
+    "Chunks by how they were answered (llm, cache, skipped, failed).",
+    ("source",))
+
+_local = threading.local()
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+@contextmanager
+def _exclusive_timer():
+    """Yields a one-item list that receives this block's own seconds (nested spans excluded)."""
+    stack = _stack()
+    stack.append(0.0)
+    result = [0.0]
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        elapsed = time.perf_counter() - start
+        nested = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        result[0] = elapsed - nested
+
+
+@contextmanager
+def span(stage):
+    """Times the block and records it under `stage` in extraction_stage_seconds."""
+    with _exclusive_timer() as seconds:
+        yield
+    STAGE_SECONDS.observe(seconds[0], stage=stage)
+    logger.debug("span %s: %.4fs", stage, seconds[0])
+
+
+def timed_iter(stage, iterable):
+    """
+    Passes the items of `iterable` through, recording the total time spent
+    producing them under `stage` once it is exhausted (or closed).
+    """
+    iterator = iter(iterable)
+    total = 0.0
+    try:
+        while True:
+            with _exclusive_timer() as seconds:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    item = StopIteration
+            total += seconds[0]
+            if item is StopIteration:
+                return
+            yield item
+    finally:
+        STAGE_SECONDS.observe(total, stage=stage)
+        logger.debug("span %s: %.4fs", stage, total)
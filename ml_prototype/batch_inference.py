@@ -0,0 +1,182 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import torch
+
+# Keys the processor produces per token (padded along the sequence dimension)
+SEQUENCE_KEYS = ("input_ids", "attention_mask", "bbox")
+# Everything the model's forward() accepts; other keys (offset_mapping,
+# overflow_to_sample_mapping) are dropped before collating
+MODEL_INPUT_KEYS = SEQUENCE_KEYS + ("pixel_values",)
+
+
+def collate_encodings(encodings, pad_token_id):
+    """
+    Pads every encoding to the longest sequence and stacks them along the
+    batch dimension. Returns (model inputs, [(row_start, row_end, seq_len)]).
+    """
+    max_len = max(enc["input_ids"].shape[1] for enc in encodings)
+    columns = {key: [] for key in MODEL_INPUT_KEYS if key in encodings[0]}
+    spans = []
+    row = 0
+    for enc in encodings:
+        seq_len = enc["input_ids"].shape[1]
+        pad = max_len - seq_len
+        for key in columns:
+            value = enc[key]
+            if isinstance(value, (list, tuple)):
+                # Overflowing windows come back with a list of page images
+                value = torch.stack(list(value))
+            if key in SEQUENCE_KEYS and pad:
+                fill = pad_token_id if key == "input_ids" else 0
+                shape = list(value.shape)
+                shape[1] = pad
+                value = torch.cat([value, value.new_full(shape, fill)], dim=1)
+            columns[key].append(value)
+        n = enc["input_ids"].shape[0]
+        spans.append((row, row + n, seq_len))
+        row += n
+    return {key: torch.cat(values, dim=0) for key, values in columns.items()}, spans
+
+
+def run_batched_inference(model, encodings, max_batch_rows=8, pad_token_id=None):
+    """
+    Synchronous counterpart of BatchInferenceWorker for scripts: runs the
+    encodings through the model in padded batches of at most
+    `max_batch_rows` rows and returns one logits tensor per encoding.
+    """
+    if pad_token_id is None:
+        pad_token_id = getattr(model.config, "pad_token_id", None) or 0
+    model.eval()
+    results = []
+    group = []
+    group_rows = 0
+
+    def flush():
+        inputs, spans = collate_encodings(group, pad_token_id)
+        with torch.inference_mode():
+            logits = model(**inputs).logits
+        results.extend(logits[start:end, :seq_len] for start, end, seq_len in spans)
+
+    for enc in encodings:
+        rows = _rows(enc)
+        if group and group_rows + rows > max_batch_rows:
+            flush()
+            group, group_rows = [], 0
+        group.append(enc)
+        group_rows += rows
+    if group:
+        flush()
+    return results
+
+
+class BatchInferenceWorker:
+    """
+    Collects encodings from concurrent requests and runs them through the
+    model together.
+
+    A single worker thread owns the model. It waits for the first pending
+    encoding, then keeps collecting for up to `max_wait_ms` (or until
+    `max_batch_size` rows are queued), pads everything to the longest
+    sequence, runs one forward pass under torch.inference_mode and hands
+    each request back its own un-padded logits.
+    """
+
+    def __init__(self, model, max_batch_size=8, max_wait_ms=20, pad_token_id=None):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        if pad_token_id is None:
+            pad_token_id = getattr(model.config, "pad_token_id", None) or 0
+        self.pad_token_id = pad_token_id
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self._requests = 0
+        self._batches = 0
+        self._rows = 0
+        self._busy_seconds = 0.0
+        self._started_at = time.time()
+
+        self.model.eval()
+        self._thread = threading.Thread(target=self._loop, name="batch-inference", daemon=True)
+        self._thread.start()
+
+    def submit(self, encoding):
+        """Queues an encoding; the Future resolves to logits of shape [rows, seq_len, num_labels]."""
+        future = Future()
+        self._queue.put((encoding, future, time.perf_counter()))
+        return future
+
+    def stats(self):
+        with self._stats_lock:
+            latencies = sorted(self._latencies)
+            uptime = time.time() - self._started_at
+            return {
+                "requests": self._requests,
+                "batches": self._batches,
+                "avg_batch_rows": round(self._rows / self._batches, 2) if self._batches else 0,
+                "throughput_rps": round(self._requests / uptime, 3) if uptime else 0,
+                "busy_seconds": round(self._busy_seconds, 3),
+                "latency_ms_p50": _percentile_ms(latencies, 0.50),
+                "latency_ms_p95": _percentile_ms(latencies, 0.95),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "queued": self._queue.qsize(),
+            }
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            rows = _rows(batch[0][0])
+            deadline = time.perf_counter() + self.max_wait
+            while rows < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                rows += _rows(item[0])
+
+            try:
+                self._run_batch(batch)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _run_batch(self, batch):
+        encodings = [encoding for encoding, _, _ in batch]
+        inputs, spans = collate_encodings(encodings, self.pad_token_id)
+
+        start = time.perf_counter()
+        with torch.inference_mode():
+            logits = self.model(**inputs).logits
+        finished = time.perf_counter()
+
+        for (encoding, future, queued_at), (row_start, row_end, seq_len) in zip(batch, spans):
+            future.set_result(logits[row_start:row_end, :seq_len])
+
+        with self._stats_lock:
+            self._requests += len(batch)
+            self._batches += 1
+            self._rows += spans[-1][1]
+            self._busy_seconds += finished - start
+            self._latencies.extend(finished - queued_at for _, _, queued_at in batch)
+
+
+def _rows(encoding):
+    return encoding["input_ids"].shape[0]
+
+
+def _percentile_ms(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return round(sorted_values[index] * 1000.0, 2)
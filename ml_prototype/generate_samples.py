@@ -1,5 +1,6 @@
 from reportlab.pdfgen import canvas
 import os
+import random
 
 def create_pdf(filename, title, content_lines):
     c = canvas.Canvas(filename)
@@ -15,6 +16,112 @@ def create_pdf(filename, title, content_lines):
     c.save()
     print(f"Created: {filename}")
 
+UNITS = ["Bioreactor", "Perfusion Skid", "Buffer Tank", "Chromatography Skid", "Viral Filtration",
+         "UF/DF Skid", "Harvest Tank", "Media Hold Tank"]
+PREFIXES = ["SV", "P", "XV", "FT", "LT", "PT", "TT", "AT", "WT", "CV"]
+ATTRIBUTES = ["", "", ".IN", ".OUT", ".Open", ".Close", ".PV", ".SP"]
+MEASURES = ["level", "pressure", "flow", "temperature", "weight", "pH"]
+
+
+def _make_image(rng, width, height):
+    """Random block pattern as a PNG-backed ImageReader (stands in for P&ID snippets)."""
+    from PIL import Image
+    from reportlab.lib.utils import ImageReader
+    img = Image.new("RGB", (width, height), "white")
+    pixels = img.load()
+    for _ in range(12):
+        x0, y0 = rng.randrange(width - 20), rng.randrange(height - 20)
+        color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        for x in range(x0, min(width, x0 + rng.randrange(10, 60))):
+            for y in range(y0, min(height, y0 + rng.randrange(10, 40))):
+                pixels[x, y] = color
+    return ImageReader(img)
+
+
+def create_narrative(filename, num_pages, seed=0, images=True):
+    """
+    Synthetic control narrative of `num_pages` pages for benchmarks: a cover
+    page with a revision table (documents of 2+ pages), then per page a
+    numbered section with prose,
+    numbered steps, If/then logic, a tag table and (with `images`) a shared
+    header logo plus one unique diagram image.
+    """
+    rng = random.Random(seed)
+    c = canvas.Canvas(filename)
+    logo = _make_image(random.Random(-1), 120, 40) if images else None
+
+    def header(page_number):
+        if logo is not None:
+            c.drawImage(logo, 470, 790, width=90, height=30)
+        c.setFont("Helvetica", 8)
+        c.drawString(50, 800, "Process Automation System (PAS) Control Narrative | Synthetic")
+        c.drawString(540, 30, str(page_number))
+
+    first_section = 1
+    if num_pages > 1:
+        header(1)
+        c.setFont("Helvetica-Bold", 18)
+        c.drawString(50, 700, "Process Automation System (PAS)")
+        c.drawString(50, 675, "Control Narrative")
+        c.setFont("Helvetica", 11)
+        y = 620
+        for line in ["Revision History", "Revision Number  Date  Description of Changes",
+                     "1  May 31, 2023  Original Version"]:
+            c.drawString(50, y, line)
+            y -= 18
+        c.showPage()
+        first_section = 2
+
+    for page_number in range(first_section, num_pages + 1):
+        header(page_number)
+        unit = rng.choice(UNITS)
+        tags = [f"{rng.choice(PREFIXES)}-{rng.randrange(100, 999)}{rng.choice(ATTRIBUTES)}" for _ in range(6)]
+        measure = rng.choice(MEASURES)
+
+        c.setFont("Helvetica-Bold", 13)
+        c.drawString(50, 760, f"2.{page_number}  {unit} Operation")
+        c.setFont("Helvetica", 10)
+        lines = [
+            f"The {unit.lower()} is controlled by the PAS. The {measure} is measured by {tags[0]}",
+            f"and maintained at setpoint by modulating {tags[1]}. Alarms are raised on deviation.",
+            "",
+            f"1. Verify {tags[2]} is closed and the permissive from {tags[3]} is active.",
+            f"2. Start pump {tags[4]} and ramp the speed to the configured setpoint.",
+            f"3. Open {tags[5]} once the {measure} is stable for 30 seconds.",
+            "",
+            f"If {tags[0]} is above the high limit, then",
+            f"    close {tags[5]} and stop {tags[4]},",
+            f"    raise a high {measure} alarm.",
+            f"Else if {tags[0]} is below the low limit, then",
+            f"    open {tags[1]} to 100% and hold.",
+        ]
+        y = 730
+        for line in lines:
+            c.drawString(50, y, line)
+            y -= 15
+
+        # Tag table
+        y -= 10
+        c.setFont("Helvetica-Bold", 10)
+        c.drawString(55, y, "Tag")
+        c.drawString(170, y, "Description")
+        c.drawString(400, y, "Range")
+        c.setFont("Helvetica", 10)
+        top = y + 14
+        for tag in tags:
+            y -= 16
+            c.drawString(55, y, tag)
+            c.drawString(170, y, f"{unit} {rng.choice(MEASURES)}")
+            c.drawString(400, y, f"0 - {rng.randrange(10, 500)}")
+        c.rect(50, y - 5, 450, top - y + 5)
+
+        if images:
+            c.drawImage(_make_image(rng, 160, 100), 50, y - 140, width=200, height=120)
+        c.showPage()
+    c.save()
+    return filename
+
+
 def main():
     # Sample 1: SUSV (The original scenario)
     create_pdf("sample_1_susv.pdf", "Control Narrative: SUSV Operation", [
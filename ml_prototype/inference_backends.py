@@ -0,0 +1,145 @@
+"""
+CPU inference backends for LayoutLMv3ForTokenClassification.
+
+Every backend is used exactly like the PyTorch model it replaces:
+`model(**inputs).logits`, `model.eval()` and `model.config`, so
+run_inference() and BatchInferenceWorker work unchanged.
+
+    torch      fp32 PyTorch (default)
+    int8       PyTorch dynamic quantization of the nn.Linear layers
+    onnx       ONNX export run through ONNX Runtime
+    onnx-int8  ONNX export with ONNX Runtime dynamic int8 weight quantization
+
+onnxruntime/onnx are optional and only imported for the onnx backends.
+"""
+import os
+
+import torch
+from transformers.modeling_outputs import TokenClassifierOutput
+
+BACKEND_TORCH = "torch"
+BACKEND_INT8 = "int8"
+BACKEND_ONNX = "onnx"
+BACKEND_ONNX_INT8 = "onnx-int8"
+BACKENDS = (BACKEND_TORCH, BACKEND_INT8, BACKEND_ONNX, BACKEND_ONNX_INT8)
+
+ONNX_INPUTS = ("input_ids", "attention_mask", "bbox", "pixel_values")
+ONNX_OPSET = 17
+
+
+def build_backend(model, backend, onnx_path=None):
+    """
+    Wraps an already loaded fp32 model in the requested backend.
+
+    For the onnx backends the export is written to `onnx_path` and reused
+    by later loads; delete the file whenever the model weights change.
+    """
+    if backend == BACKEND_TORCH:
+        return model.eval()
+    if backend == BACKEND_INT8:
+        return quantize_int8(model)
+    if backend in (BACKEND_ONNX, BACKEND_ONNX_INT8):
+        if onnx_path is None:
+            raise ValueError("onnx backends need an onnx_path to export to")
+        if backend == BACKEND_ONNX_INT8:
+            onnx_path = _quantized_path(onnx_path)
+        if not os.path.exists(onnx_path):
+            export_onnx(model, onnx_path, quantize=backend == BACKEND_ONNX_INT8)
+        return OnnxTokenClassifier(onnx_path, model.config)
+    raise ValueError(f"Unknown inference backend '{backend}', expected one of {', '.join(BACKENDS)}")
+
+
+def quantize_int8(model):
+    """Dynamic int8 quantization: Linear weights in int8, activations quantized on the fly."""
+    from torch.ao.quantization import quantize_dynamic
+    # The relative position biases are Linear modules whose .weight is indexed
+    # directly instead of being called, so they have to stay in fp32
+    layers = {
+        name for name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear) and "rel_pos" not in name
+    }
+    return quantize_dynamic(model.eval(), layers, dtype=torch.qint8)
+
+
+def export_onnx(model, path, quantize=False):
+    """Exports the model with dynamic batch/sequence axes (optionally int8-quantized)."""
+    print(f"Exporting ONNX model to {path}...")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    size = model.config.input_size
+    seq_len = 16
+    dummy = (
+        torch.full((1, seq_len), 5, dtype=torch.long),
+        torch.ones(1, seq_len, dtype=torch.long),
+        torch.zeros(1, seq_len, 4, dtype=torch.long),
+        torch.zeros(1, 3, size, size),
+    )
+    sequence_axes = {0: "batch", 1: "sequence"}
+    fp32_path = path + ".fp32.tmp" if quantize else path + ".tmp"
+    with torch.inference_mode():
+        torch.onnx.export(
+            _LogitsOnly(model.eval()),
+            dummy,
+            fp32_path,
+            input_names=list(ONNX_INPUTS),
+            output_names=["logits"],
+            dynamic_axes={
+                "input_ids": sequence_axes,
+                "attention_mask": sequence_axes,
+                "bbox": sequence_axes,
+                "pixel_values": {0: "batch"},
+                "logits": sequence_axes,
+            },
+            opset_version=ONNX_OPSET,
+            dynamo=False,
+        )
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, path + ".tmp", weight_type=QuantType.QInt8)
+        os.remove(fp32_path)
+    # Rename last so an interrupted export is never picked up as a cached model
+    os.replace(path + ".tmp", path)
+    return path
+
+
+class OnnxTokenClassifier:
+    """ONNX Runtime session with the call signature of the PyTorch model."""
+
+    def __init__(self, path, config, num_threads=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.config = config
+        self.path = path
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self._input_names = [i.name for i in self.session.get_inputs()]
+
+    def eval(self):
+        return self
+
+    def __call__(self, **inputs):
+        # Processor extras (offset_mapping, overflow_to_sample_mapping) are not model inputs
+        feed = {}
+        for name in self._input_names:
+            value = inputs[name]
+            if isinstance(value, (list, tuple)):
+                value = torch.stack(list(value))
+            feed[name] = value.detach().cpu().numpy()
+        logits, = self.session.run(["logits"], feed)
+        return TokenClassifierOutput(logits=torch.from_numpy(logits))
+
+
+class _LogitsOnly(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, bbox, pixel_values):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask,
+                          bbox=bbox, pixel_values=pixel_values).logits
+
+
+def _quantized_path(path):
+    root, ext = os.path.splitext(path)
+    return f"{root}.int8{ext or '.onnx'}"
@@ -1,9 +1,10 @@
+import fitz
 import torch
 from transformers import LayoutLMv3ForTokenClassification, LayoutLMv3Processor
-from pdf2image import convert_from_path
 from PIL import Image
 import json
 import os
+import sys
 
 # --- Configuration ---
 # In a real scenario, these labels must match your fine-tuned model's config
@@ -19,65 +20,124 @@ LABELS_MAP = {
 
 MODEL_ID = "microsoft/layoutlmv3-base"
 
+# Inference backend: torch (fp32), int8, onnx or onnx-int8 (see inference_backends.py)
+INFERENCE_BACKEND = os.environ.get("LAYOUTLM_BACKEND", "torch")
+# Where the onnx backends export the model to (and load it from afterwards)
+ONNX_PATH = os.environ.get(
+    "LAYOUTLM_ONNX_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "onnx", MODEL_ID.split("/")[-1] + ".onnx"),
+)
+
+# Sliding-window settings for pages longer than the model's 512-token limit
+MAX_SEQ_LENGTH = 512
+WINDOW_STRIDE = 128
+
+# The LayoutLMv3 image processor resizes every page to 224x224, so pages are
+# rendered straight to that size instead of at full DPI
+PROCESSOR_IMAGE_SIZE = 224
+# Resolution used only for OCR of pages without a text layer
+OCR_DPI = 200
+
 def normalize_bbox(bbox, width, height):
     """
     Normalize bounding box coordinates to 0-1000 scale.
     bbox: [x0, y0, x1, y1]
     """
+    # Clamp: text-layer words can poke slightly outside the page box
     return [
-        int(1000 * (bbox[0] / width)),
-        int(1000 * (bbox[1] / height)),
-        int(1000 * (bbox[2] / width)),
-        int(1000 * (bbox[3] / height)),
+        min(1000, max(0, int(1000 * (bbox[0] / width)))),
+        min(1000, max(0, int(1000 * (bbox[1] / height)))),
+        min(1000, max(0, int(1000 * (bbox[2] / width)))),
+        min(1000, max(0, int(1000 * (bbox[3] / height)))),
     ]
 
-def load_model():
-    print(f"Loading model: {MODEL_ID}...")
+def load_model(backend=None):
+    from inference_backends import build_backend
+    backend = backend or INFERENCE_BACKEND
+    print(f"Loading model: {MODEL_ID} (backend: {backend})...")
     # Note: Using num_labels to initialize the classification head. 
     # Without fine-tuning, predictions will be random/untrained.
     model = LayoutLMv3ForTokenClassification.from_pretrained(MODEL_ID, num_labels=len(LABELS_MAP))
+    # int8/ONNX variants keep the model's call signature, so callers don't change
+    model = build_backend(model, backend, onnx_path=ONNX_PATH)
     # CRITICAL: Set apply_ocr=False because we are providing our own words/boxes
     processor = LayoutLMv3Processor.from_pretrained(MODEL_ID, apply_ocr=False)
     return model, processor
 
-def preprocess_document(pdf_path, processor):
-    print(f"Processing document: {pdf_path}")
-    
-    # 1. PDF to Image
-    # Requires poppler installed on the system
+def open_pdf(source):
+    """
+    Opens a PDF from a file path or from the raw bytes of an upload, so
+    concurrent requests never have to share a file on disk.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=bytes(source), filetype="pdf")
+    return fitz.open(source)
+
+def _describe(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return f"<{len(source)} bytes in memory>"
+    return source
+
+def page_words(page):
+    """
+    Words and normalized boxes for one PyMuPDF page, read from the PDF text
+    layer. Pages without a text layer (scans) fall back to OCR.
+    """
+    width, height = page.rect.width, page.rect.height
+    words, boxes = [], []
+    for x0, y0, x1, y1, text, *_ in page.get_text("words"):
+        words.append(text)
+        boxes.append(normalize_bbox([x0, y0, x1, y1], width, height))
+    if not words:
+        words, boxes = ocr_page(page)
+    return words, boxes
+
+def ocr_page(page):
+    """OCR fallback (pytesseract, optional) for pages with no text layer."""
     try:
-        images = convert_from_path(pdf_path)
-    except Exception as e:
-        print(f"Error converting PDF: {e}")
-        print("Ensure 'poppler' is installed (e.g., 'brew install poppler' on Mac).")
-        return None, None, None
+        import pytesseract
+    except ImportError:
+        print(f"Page {page.number + 1} has no text layer and pytesseract is not installed; skipping.")
+        return [], []
 
-    if not images:
-        print("No images converted from PDF.")
-        return None, None, None
+    print(f"Page {page.number + 1} has no text layer, running OCR...")
+    pix = page.get_pixmap(dpi=OCR_DPI, alpha=False)
+    image = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
+    words, boxes = [], []
+    for text, left, top, w, h in zip(data["text"], data["left"], data["top"], data["width"], data["height"]):
+        if text.strip():
+            words.append(text)
+            boxes.append(normalize_bbox([left, top, left + w, top + h], pix.width, pix.height))
+    return words, boxes
 
-    image = images[0].convert("RGB") # Take first page
-    width, height = image.size
+def render_page(page, size=PROCESSOR_IMAGE_SIZE):
+    """Renders a page directly at the processor's input resolution."""
+    matrix = fitz.Matrix(size / page.rect.width, size / page.rect.height)
+    pix = page.get_pixmap(matrix=matrix, alpha=False)
+    return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
 
-    # 2. OCR Emulation (Mock Data for Prototype)
-    # In production, use pytesseract.image_to_data(image)
-    print("Emulating OCR...")
-    words = ["SUSV", "Flow", "Rate", "Tolerance", "P-101", "Incoming", "Flow", "Rate"]
+def preprocess_document(pdf_source, processor):
+    """pdf_source: a file path or the PDF bytes."""
+    print(f"Processing document: {_describe(pdf_source)}")
     
-    # Mock Bounding Boxes [x0, y0, x1, y1] (Unnormalized)
-    raw_boxes = [
-        [100, 100, 200, 150], # SUSV
-        [210, 100, 300, 150], # Flow
-        [310, 100, 400, 150], # Rate
-        [100, 200, 300, 250], # Tolerance
-        [400, 400, 500, 450], # P-101
-        [100, 500, 200, 550], # Incoming
-        [210, 500, 300, 550], # Flow
-        [310, 500, 400, 550]  # Rate
-    ]
+    # 1. Words & boxes from the first page's text layer (OCR only if it has none)
+    try:
+        with open_pdf(pdf_source) as doc:
+            if len(doc) == 0:
+                print("PDF has no pages.")
+                return None, None, None
+            page = doc[0] # Take first page
+            words, boxes = page_words(page)
+            # 2. Render just this page, at the size the processor uses
+            image = render_page(page)
+    except Exception as e:
+        print(f"Error reading PDF: {e}")
+        return None, None, None
 
-    # Normalize Boxes
-    boxes = [normalize_bbox(box, width, height) for box in raw_boxes]
+    if not words:
+        print("No text found on the first page.")
+        return None, None, None
 
     # 3. Tokenization & Encoding
     print("Tokenizing...")
@@ -86,45 +146,248 @@ def preprocess_document(pdf_path, processor):
         text=words,
         boxes=boxes,
         return_tensors="pt",
-        truncation=True,
-        padding="max_length"
+        truncation=True
+        # No padding here: batched inference pads to the longest sequence in the batch
     )
 
     return encoding, words, boxes
 
-def run_inference(model, encoding):
+def encode_page_windows(image, words, boxes, processor, stride=WINDOW_STRIDE):
+    """
+    Encodes one page into as many overlapping windows as it needs: pages
+    longer than MAX_SEQ_LENGTH tokens overflow into extra rows that share
+    `stride` tokens with the previous window, so no word is dropped.
+    """
+    return processor(
+        images=image,
+        text=words,
+        boxes=boxes,
+        return_tensors="pt",
+        truncation=True,
+        max_length=MAX_SEQ_LENGTH,
+        stride=stride,
+        return_overflowing_tokens=True,
+        return_offsets_mapping=True,
+        padding="longest"
+    )
+
+def covered_word_count(encoding):
+    """Number of leading words that kept at least one token after truncation."""
+    word_ids = [w for w in encoding.word_ids(0) if w is not None]
+    return max(word_ids) + 1 if word_ids else 0
+
+def merge_window_logits(encoding, logits, num_words):
+    """
+    Folds token logits from all windows of a page back onto its words.
+    Every sub-word token of a word, in every window that contains it,
+    contributes; the result is their mean, shape [num_words, num_labels].
+    """
+    token_word_ids = []
+    for row in range(logits.shape[0]):
+        row_ids = encoding.word_ids(row)[:logits.shape[1]]
+        token_word_ids.append([-1 if w is None else w for w in row_ids]
+                              + [-1] * (logits.shape[1] - len(row_ids)))
+    word_ids = torch.tensor(token_word_ids).flatten()
+    flat_logits = logits.reshape(-1, logits.shape[-1]).float()
+
+    mask = word_ids >= 0
+    ids = word_ids[mask]
+    sums = torch.zeros(num_words, logits.shape[-1]).index_add_(0, ids, flat_logits[mask])
+    counts = torch.bincount(ids, minlength=num_words).clamp(min=1).unsqueeze(-1)
+    return sums / counts
+
+def extract_document(pdf_source, processor, infer_fn, pages_per_group=4, stride=WINDOW_STRIDE):
+    """
+    Document-level mode: every page is encoded (long pages as stride
+    windows), groups of pages run through `infer_fn` together and window
+    logits are merged back to one label per word.
+
+    `infer_fn(encodings) -> [logits per encoding]` is run_batched_inference
+    bound to a model for scripts, or the server's batching worker.
+    `pdf_source` is a file path or the PDF bytes.
+    Returns a list of {"page", "words", "boxes", "logits"} dicts, logits
+    being per word (see structure_output).
+    """
+    print(f"Processing document (all pages): {_describe(pdf_source)}")
+    try:
+        doc = open_pdf(pdf_source)
+    except Exception as e:
+        print(f"Error reading PDF: {e}")
+        return None
+
+    results = []
+    with doc:
+        for group_start in range(0, len(doc), pages_per_group):
+            pages = []
+            for page_no in range(group_start, min(group_start + pages_per_group, len(doc))):
+                page = doc[page_no]
+                words, boxes = page_words(page)
+                if not words:
+                    continue
+                # Only pages that are actually inferred get rendered
+                encoding = encode_page_windows(render_page(page), words, boxes, processor, stride=stride)
+                pages.append((page_no, words, boxes, encoding))
+            if not pages:
+                continue
+
+            group_logits = infer_fn([encoding for _, _, _, encoding in pages])
+            for (page_no, words, boxes, encoding), logits in zip(pages, group_logits):
+                results.append({
+                    "page": page_no + 1,
+                    "words": words,
+                    "boxes": boxes,
+                    "logits": merge_window_logits(encoding, logits, len(words)),
+                })
+
+    return results
+
+def run_inference(model, encoding, return_logits=False):
     print("Running inference...")
     model.eval()
-    with torch.no_grad():
+    with torch.inference_mode():
         outputs = model(**encoding)
     
     # Get Logits and Predictions
     logits = outputs.logits
+    if return_logits:
+        return logits
     predictions = logits.argmax(-1).squeeze().tolist()
     
     return predictions
 
-def structure_output(words, boxes, predictions, id2label):
+OUTPUT_FORMATS = ("records", "entities", "compact")
+
+def structure_output(words, boxes, word_logits, id2label, output_format="records", page=None):
+    """
+    Turns per-word logits (merge_window_logits output) into labelled words
+    and entities. Softmax, argmax and the B-/I- span merge run as tensor ops
+    over the whole page; Python only builds the response rows.
+
+    output_format:
+      "records"  - one {"token", "bbox", "label", "confidence"} per word
+      "entities" - one {"text", "label", "bbox", "confidence", "start", "end"}
+                   per merged B-/I- span (end is exclusive)
+      "compact"  - columnar {"labels", "words": {...}, "entities": {...}}
+                   (word labels are ids into "labels", entity labels are type names)
+    With `page`, every row (or a "page" column) records the page number.
+    """
     print("Structuring output...")
-    structured_data = []
-    
-    # Iterate through tokens
-    # Note: encoding length might differ from word length due to sub-word tokenization.
-    # For this prototype, we assume 1-to-1 mapping for simplicity.
-    
-    for i, (word, box, pred_id) in enumerate(zip(words, boxes, predictions)):
-        label = id2label.get(pred_id, "O")
-        
-        # In a real app, you might filter out 'O' labels to reduce noise
-        entry = {
-            "token": word,
-            "bbox": box,
-            "label": label,
-            "confidence": 0.99 # Placeholder
+    probs = torch.softmax(word_logits.float(), dim=-1)
+    confidence, label_ids = probs.max(dim=-1)
+    entities = merge_entities(label_ids, confidence, torch.tensor(boxes, dtype=torch.long).reshape(-1, 4), id2label)
+
+    if output_format == "compact":
+        num_labels = max(id2label) + 1
+        result = {
+            "labels": [id2label.get(i, "O") for i in range(num_labels)],
+            "words": {
+                "token": list(words),
+                "bbox": [list(box) for box in boxes],
+                "label": label_ids.tolist(),
+                "confidence": confidence.double().round(decimals=4).tolist(),
+            },
+            "entities": {
+                "text": [" ".join(words[s:e]) for s, e in zip(entities["start"], entities["end"])],
+                **entities,
+            },
         }
-        structured_data.append(entry)
-            
-    return structured_data
+        if page is not None:
+            result["words"]["page"] = [page] * len(words)
+            result["entities"]["page"] = [page] * len(entities["start"])
+        return result
+
+    if output_format == "entities":
+        rows = [
+            {"text": " ".join(words[s:e]), "label": label, "bbox": box, "confidence": conf, "start": s, "end": e}
+            for s, e, label, box, conf in zip(entities["start"], entities["end"], entities["label"],
+                                              entities["bbox"], entities["confidence"])
+        ]
+    else:
+        rows = [
+            {"token": word, "bbox": box, "label": id2label.get(label_id, "O"), "confidence": conf}
+            for word, box, label_id, conf in zip(words, boxes, label_ids.tolist(),
+                                                 confidence.double().round(decimals=4).tolist())
+        ]
+    if page is not None:
+        for row in rows:
+            row["page"] = page
+    return rows
+
+def structure_pages(pages, id2label, output_format="records"):
+    """structure_output over extract_document() pages, concatenated in page order."""
+    if output_format != "compact":
+        result = []
+        for page in pages:
+            result.extend(structure_output(page["words"], page["boxes"], page["logits"], id2label,
+                                           output_format, page=page["page"]))
+        return result
+
+    result = None
+    for page in pages:
+        part = structure_output(page["words"], page["boxes"], page["logits"], id2label, output_format, page=page["page"])
+        if result is None:
+            result = part
+            continue
+        for section in ("words", "entities"):
+            for column, values in part[section].items():
+                result[section][column].extend(values)
+    return result or structure_output([], [], torch.zeros(0, max(id2label) + 1), id2label, output_format)
+
+def merge_entities(label_ids, confidence, boxes, id2label):
+    """
+    Merges consecutive B-X/I-X words into entity spans without a per-word
+    loop. A span starts at a B- tag or where the entity type changes, so a
+    stray I- tag after O (or after another type) opens a new span.
+    Returns columns: start, end (exclusive), label, bbox (union), confidence (mean).
+    """
+    type_of, begins, type_names = _bio_tables(id2label)
+    columns = {"start": [], "end": [], "label": [], "bbox": [], "confidence": []}
+    if label_ids.numel() == 0:
+        return columns
+
+    types = type_of[label_ids]
+    inside = types > 0
+    previous = torch.cat([types.new_zeros(1), types[:-1]])
+    starts = inside & (begins[label_ids] | (types != previous))
+    num_entities = int(starts.sum())
+    if num_entities == 0:
+        return columns
+
+    entity_of = (torch.cumsum(starts.long(), 0) - 1)[inside]
+    positions = torch.arange(label_ids.numel())[inside]
+    ends = torch.zeros(num_entities, dtype=torch.long).scatter_reduce(0, entity_of, positions + 1, "amax")
+    counts = torch.bincount(entity_of, minlength=num_entities)
+    mean_conf = torch.zeros(num_entities).index_add_(0, entity_of, confidence[inside].float()) / counts
+
+    word_boxes = boxes[inside]
+    index = entity_of.unsqueeze(-1).expand(-1, 2)
+    top_left = torch.full((num_entities, 2), 1000, dtype=torch.long).scatter_reduce(0, index, word_boxes[:, :2], "amin")
+    bottom_right = torch.zeros(num_entities, 2, dtype=torch.long).scatter_reduce(0, index, word_boxes[:, 2:], "amax")
+
+    columns["start"] = torch.nonzero(starts).flatten().tolist()
+    columns["end"] = ends.tolist()
+    columns["label"] = [type_names[t] for t in types[starts].tolist()]
+    columns["bbox"] = torch.cat([top_left, bottom_right], dim=-1).tolist()
+    columns["confidence"] = mean_conf.double().round(decimals=4).tolist()
+    return columns
+
+def _bio_tables(id2label):
+    """Per label id: entity type index (0 = outside), whether it is a B- tag, and the type names."""
+    num_labels = max(id2label) + 1
+    type_of = torch.zeros(num_labels, dtype=torch.long)
+    begins = torch.zeros(num_labels, dtype=torch.bool)
+    type_names = [None]
+    for label_id, label in id2label.items():
+        if label == "O":
+            continue
+        prefix, _, name = label.partition("-")
+        if not name:
+            prefix, name = "B", label
+        if name not in type_names:
+            type_names.append(name)
+        type_of[label_id] = type_names.index(name)
+        begins[label_id] = prefix == "B"
+    return type_of, begins, type_names
 
 def main():
     # Create a dummy PDF if it doesn't exist for testing
@@ -134,18 +397,30 @@ def main():
         print("For testing purposes, ensure you have a PDF named 'sample_document.pdf'.")
         return
 
-    model, processor = load_model()
-    encoding, words, boxes = preprocess_document(pdf_path, processor)
-    
-    if encoding is None:
-        return
+    backend = next((a.split("=", 1)[1] for a in sys.argv if a.startswith("--backend=")), None)
+    model, processor = load_model(backend)
+    output_format = next((a.split("=", 1)[1] for a in sys.argv if a.startswith("--format=")), "records")
 
-    predictions = run_inference(model, encoding)
-    
-    # Align predictions (Simplified)
-    aligned_predictions = predictions[:len(words)]
-    
-    result = structure_output(words, boxes, aligned_predictions, LABELS_MAP)
+    if "--all-pages" in sys.argv:
+        # Document-level mode: every page, long pages as sliding windows
+        from batch_inference import run_batched_inference
+        pages = extract_document(pdf_path, processor, lambda encodings: run_batched_inference(model, encodings))
+        if pages is None:
+            return
+        result = structure_pages(pages, LABELS_MAP, output_format)
+    else:
+        encoding, words, boxes = preprocess_document(pdf_path, processor)
+        
+        if encoding is None:
+            return
+
+        logits = run_inference(model, encoding, return_logits=True)
+        
+        # Align sub-word tokens to words; words cut off by truncation are dropped
+        num_words = covered_word_count(encoding)
+        word_logits = merge_window_logits(encoding, logits, num_words)
+        
+        result = structure_output(words[:num_words], boxes[:num_words], word_logits, LABELS_MAP, output_format)
     
     # Output JSON
     output_json = json.dumps(result, indent=2)
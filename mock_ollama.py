@@ -0,0 +1,225 @@
+"""
+Local stand-in for the Ollama HTTP API, for tests and benchmarks without a
+GPU or a real model.
+
+Serves /api/chat, /api/generate, /api/tags and /api/version with Ollama's
+response shape and timing fields. Latency is configurable (fixed per call,
+per prompt token evaluated and per generated token), and a prompt cache is
+simulated: the longest token prefix shared with a recent request is not
+evaluated again, just like the llama.cpp cache behind Ollama. Every request
+body is kept in `requests` for assertions. A JSON schema `format` is
+honored for the top-level keys of JSON answers.
+
+Usage:
+    python mock_ollama.py [--port 11435] [--latency-ms 50] [--prompt-ms-per-token 0.5]
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tags import TAG_RE
+
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def default_responder(messages, request):
+    """Answers like the extraction model: every tag in the user message becomes equipment."""
+    text = messages[-1]["content"] if messages else ""
+    tags = list(dict.fromkeys(TAG_RE.findall(text)))
+    return json.dumps({
+        "equipment": [{"id": tag, "name": tag, "description": f"Mock entity {tag}"} for tag in tags],
+        "parameters": [],
+        "variables": [],
+        "conditions": [],
+        "actions": [],
+    })
+
+
+def _apply_format(content, format):
+    """Mimics constrained decoding: a schema `format` keeps only the schema's top-level keys."""
+    if not isinstance(format, dict) or "properties" not in format:
+        return content
+    try:
+        answer = json.loads(content)
+    except ValueError:
+        return content
+    if not isinstance(answer, dict):
+        return content
+    return json.dumps({key: answer.get(key, []) for key in format["properties"]})
+
+
+class MockOllamaServer:
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=0.0, prompt_ms_per_token=0.0,
+                 eval_ms_per_token=0.0, load_ms=0.0, cache_slots=4, responder=default_responder):
+        self.latency_ms = latency_ms
+        self.prompt_ms_per_token = prompt_ms_per_token
+        self.eval_ms_per_token = eval_ms_per_token
+        self.load_ms = load_ms
+        self.cache_slots = cache_slots
+        self.responder = responder
+        self.requests = []
+        self.loaded_models = set()
+        self._cache = []   # recently evaluated prompts (token lists), most recent last
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # --- Simulation ---
+
+    def chat(self, request):
+        model = request.get("model", "")
+        messages = request.get("messages") or []
+        with self._lock:
+            self.requests.append(request)
+            load_ms = 0.0
+            if model not in self.loaded_models:
+                self.loaded_models.add(model)
+                load_ms = self.load_ms
+        if not messages:
+            # Ollama loads the model and returns immediately for an empty chat
+            time.sleep(load_ms / 1000.0)
+            return {"model": model, "message": {"role": "assistant", "content": ""}, "done": True,
+                    "done_reason": "load", "load_duration": int(load_ms * 1e6)}
+
+        prompt = []
+        for message in messages:
+            prompt.append(f"<|{message.get('role')}|>")
+            prompt.extend(TOKEN_RE.findall(message.get("content", "")))
+        reused = self._reuse_prefix(prompt)
+        evaluated = len(prompt) - reused
+
+        content = _apply_format(self.responder(messages, request), request.get("format"))
+        num_predict = (request.get("options") or {}).get("num_predict")
+        eval_count = len(TOKEN_RE.findall(content))
+        if num_predict is not None and num_predict >= 0:
+            eval_count = min(eval_count, num_predict)
+            content = "OK" if num_predict <= 1 else content
+
+        prompt_ms = evaluated * self.prompt_ms_per_token
+        eval_ms = eval_count * self.eval_ms_per_token
+        total_ms = self.latency_ms + load_ms + prompt_ms + eval_ms
+        time.sleep(total_ms / 1000.0)
+        return {
+            "model": model,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "message": {"role": "assistant", "content": content},
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int(total_ms * 1e6),
+            "load_duration": int(load_ms * 1e6),
+            "prompt_eval_count": evaluated,
+            "prompt_eval_duration": int(prompt_ms * 1e6),
+            "eval_count": eval_count,
+            "eval_duration": int(eval_ms * 1e6),
+        }
+
+    def generate(self, request):
+        messages = []
+        if request.get("system"):
+            messages.append({"role": "system", "content": request["system"]})
+        if request.get("prompt"):
+            messages.append({"role": "user", "content": request["prompt"]})
+        response = self.chat(dict(request, messages=messages))
+        response["response"] = response.pop("message")["content"]
+        return response
+
+    def _reuse_prefix(self, prompt):
+        with self._lock:
+            best = 0
+            for cached in self._cache:
+                shared = 0
+                for a, b in zip(cached, prompt):
+                    if a != b:
+                        break
+                    shared += 1
+                best = max(best, shared)
+            self._cache.append(prompt)
+            del self._cache[:-self.cache_slots]
+        # The last token is always evaluated, as in llama.cpp
+        return min(best, len(prompt) - 1)
+
+    def _make_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/api/version":
+                    self._send({"version": "0.0.0-mock"})
+                elif self.path == "/api/tags":
+                    self._send({"models": [{"name": name} for name in sorted(mock.loaded_models)]})
+                else:
+                    self._send({"error": "not found"}, 404)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    request = json.loads(self.rfile.read(length) or b"{}")
+                except json.JSONDecodeError:
+                    self._send({"error": "invalid JSON"}, 400)
+                    return
+                if self.path == "/api/chat":
+                    self._send(mock.chat(request))
+                elif self.path == "/api/generate":
+                    self._send(mock.generate(request))
+                else:
+                    self._send({"error": "not found"}, 404)
+
+            def _send(self, body, status=200):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--prompt-ms-per-token", type=float, default=0.0)
+    parser.add_argument("--eval-ms-per-token", type=float, default=0.0)
+    parser.add_argument("--load-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = MockOllamaServer(args.host, args.port, args.latency_ms, args.prompt_ms_per_token,
+                              args.eval_ms_per_token, args.load_ms)
+    print(f"Mock Ollama listening on {server.url} (set OLLAMA_HOST={server.url})")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
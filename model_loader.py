@@ -0,0 +1,76 @@
+import threading
+import time
+
+MODEL_LOADING = "loading"
+MODEL_READY = "ready"
+MODEL_FAILED = "failed"
+MODEL_DISABLED = "disabled"
+
+
+class BackgroundModel:
+    """
+    Loads a heavy model on a daemon thread so the server can start
+    answering requests (e.g. the splitter page) straight away.
+
+    `load_fn` does the imports and loading and returns the loaded object.
+    Until it finishes, `value` is None and `status()` reports "loading";
+    routes that need the model should answer with a "warming up" response.
+    A failed load is kept with its error instead of being swallowed.
+    """
+
+    def __init__(self, name, load_fn):
+        self.name = name
+        self._load_fn = load_fn
+        self._state = MODEL_LOADING
+        self._error = None
+        self._value = None
+        self._started_at = None
+        self._ready_at = None
+        self._ready = threading.Event()
+
+    def start(self):
+        self._started_at = time.time()
+        thread = threading.Thread(target=self._load, name=f"load-{self.name}", daemon=True)
+        thread.start()
+        return self
+
+    def disable(self, reason):
+        self._state = MODEL_DISABLED
+        self._error = reason
+        self._ready.set()
+        return self
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def value(self):
+        return self._value if self._state == MODEL_READY else None
+
+    def wait(self, timeout=None):
+        """Blocks until loading has finished (successfully or not)."""
+        return self._ready.wait(timeout)
+
+    def status(self):
+        status = {"name": self.name, "status": self._state}
+        if self._error:
+            status["error"] = self._error
+        if self._ready_at and self._started_at:
+            status["load_seconds"] = round(self._ready_at - self._started_at, 2)
+        return status
+
+    def _load(self):
+        print(f"Loading {self.name} in the background...")
+        try:
+            self._value = self._load_fn()
+            self._state = MODEL_READY
+            print(f"{self.name} loaded!")
+        except Exception as e:
+            # ImportError (missing torch/transformers) lands here too
+            print(f"Failed to load {self.name}: {e}")
+            self._error = str(e)
+            self._state = MODEL_FAILED
+        finally:
+            self._ready_at = time.time()
+            self._ready.set()
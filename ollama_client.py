@@ -0,0 +1,163 @@
+import json
+import logging
+import threading
+import time
+import urllib.error
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+
+class OllamaError(Exception):
+    """Raised when the Ollama server cannot be reached or returns an error."""
+
+
+class CallTimings:
+    """
+    Thread-safe totals of Ollama's per-call timings. A client keeps one for
+    all its calls; a caller can pass its own to chat() to total the calls
+    of one document while other documents share the client.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {
+            "calls": 0,
+            "prompt_eval_tokens": 0,
+            "prompt_eval_ms": 0.0,
+            "eval_tokens": 0,
+            "eval_ms": 0.0,
+            "load_ms": 0.0,
+            "wall_ms": 0.0,
+        }
+
+    def add(self, call):
+        with self._lock:
+            self._totals["calls"] += 1
+            for key, value in call.items():
+                self._totals[key] += value
+
+    def report(self):
+        with self._lock:
+            totals = dict(self._totals)
+        for key in ("prompt_eval_ms", "eval_ms", "load_ms", "wall_ms"):
+            totals[key] = round(totals[key], 1)
+        return totals
+
+
+class OllamaClient:
+    """
+    Minimal thread-safe client for Ollama's /api/chat endpoint.
+
+    The system prompt is sent as its own, byte-identical system message on
+    every call, so every request shares the same prefix and the server can
+    reuse the evaluated prefix from its prompt cache instead of re-reading
+    it per chunk. `keep_alive` keeps the model resident between documents
+    and `preload()` loads it (and warms the prefix) ahead of the first
+    upload.
+
+    `format` ("json" or a JSON schema) constrains every reply to that shape;
+    a call can pass its own `format` (e.g. a narrower schema).
+
+    Each call logs Ollama's own timings at debug level: prompt evaluation
+    (tokens actually processed, so a cache hit shows up as a small count)
+    versus generation. `stats()` keeps the totals; a CallTimings passed as
+    `timings` also receives the call's numbers.
+    """
+
+    def __init__(self, model, base_url="http://localhost:11434", system=None, temperature=0.0,
+                 keep_alive="30m", num_ctx=None, timeout=300, format=None):
+        self.model = model
+        self.format = format
+        self.base_url = base_url.rstrip("/")
+        self.system = system
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.options = {"temperature": temperature}
+        if num_ctx:
+            self.options["num_ctx"] = num_ctx
+        self._totals = CallTimings()
+
+    def chat(self, content, system=None, label="", history=None, format=None, timings=None, **options):
+        """
+        Sends one user message (after the system message and any `history`
+        turns, e.g. an earlier question and answer) and returns the reply text.
+        The call's timings are added to `timings` (a CallTimings) if given.
+        """
+        messages = []
+        system = system if system is not None else self.system
+        if system:
+            messages.append({"role": "system", "content": system})
+        messages.extend(history or ())
+        messages.append({"role": "user", "content": content})
+
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "stream": False,
+            "keep_alive": self.keep_alive,
+            "options": dict(self.options, **options),
+        }
+        format = format if format is not None else self.format
+        if format:
+            payload["format"] = format
+
+        start = time.perf_counter()
+        response = self._post("/api/chat", payload)
+        wall_ms = (time.perf_counter() - start) * 1000.0
+        call = self._record(response, wall_ms, label)
+        if timings is not None:
+            timings.add(call)
+        return response.get("message", {}).get("content", "")
+
+    def preload(self):
+        """
+        Loads the model into memory and evaluates the system prompt once, so
+        the first real request only pays for its own chunk.
+        """
+        start = time.perf_counter()
+        # An empty message list only loads the model
+        self._post("/api/chat", {"model": self.model, "messages": [], "keep_alive": self.keep_alive,
+                                 "options": self.options})
+        if self.system:
+            self.chat("Reply with OK.", label="warm-up", num_predict=1)
+        print(f"Ollama model {self.model} preloaded in {time.perf_counter() - start:.1f}s "
+              f"(keep_alive={self.keep_alive})")
+        return self
+
+    def stats(self):
+        """Totals over every call made with this client."""
+        return self._totals.report()
+
+    def _record(self, response, wall_ms, label):
+        """Adds one response's timings to the client totals and returns them."""
+        prompt_tokens = response.get("prompt_eval_count", 0) or 0
+        prompt_ms = (response.get("prompt_eval_duration", 0) or 0) / 1e6
+        eval_tokens = response.get("eval_count", 0) or 0
+        eval_ms = (response.get("eval_duration", 0) or 0) / 1e6
+        load_ms = (response.get("load_duration", 0) or 0) / 1e6
+        call = {"prompt_eval_tokens": prompt_tokens, "prompt_eval_ms": prompt_ms, "eval_tokens": eval_tokens,
+                "eval_ms": eval_ms, "load_ms": load_ms, "wall_ms": wall_ms}
+        self._totals.add(call)
+        logger.debug("%sOllama: prompt eval %d tok in %.0fms, generation %d tok in %.0fms, "
+                     "load %.0fms, wall %.0fms", f"[{label}] " if label else "", prompt_tokens, prompt_ms,
+                     eval_tokens, eval_ms, load_ms, wall_ms)
+        return call
+
+    def _post(self, path, payload):
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = json.loads(response.read().decode("utf-8") or "{}")
+        except urllib.error.HTTPError as e:
+            detail = e.read().decode("utf-8", errors="replace")
+            raise OllamaError(f"Ollama {path} returned {e.code}: {detail}") from e
+        except (urllib.error.URLError, OSError) as e:
+            raise OllamaError(f"Ollama unreachable at {self.base_url}: {e}") from e
+        if isinstance(body, dict) and body.get("error"):
+            raise OllamaError(f"Ollama {path} error: {body['error']}")
+        return body
@@ -33,3 +33,35 @@ Return a single JSON object with the following keys. Do NOT include markdown for
   "actions":    [ { "name": "...", "description": "..." } ]
 }
 """
+
+# Follow-up turn after a "conditions-only" answer: asks for the missing
+# categories only. Sent after the original message and answer, which Ollama
+# still holds in its prompt cache, so only this short turn is evaluated.
+CATEGORY_REASK_PROMPT = """Your answer has conditions but no {missing}.
+Re-read the data and list ONLY the {missing} it names.
+Return a single JSON object with only these keys: {keys}. Use [] when there are none."""
+
+# JSON schema of the answer above, sent as Ollama's `format` so decoding is
+# constrained to it. The same schema validates replies before any repair.
+ID_CATEGORIES = ["equipment", "parameters", "variables"]
+ALL_CATEGORIES = ["equipment", "parameters", "variables", "conditions", "actions"]
+
+
+def category_schema(categories=ALL_CATEGORIES):
+    """Schema for an answer holding exactly `categories` (a re-ask asks for fewer)."""
+    def item(with_id):
+        properties = {"name": {"type": "string"}, "description": {"type": "string"}}
+        if with_id:
+            properties = {"id": {"type": "string"}, **properties}
+        return {"type": "object", "properties": properties, "required": list(properties),
+                "additionalProperties": False}
+
+    return {
+        "type": "object",
+        "properties": {cat: {"type": "array", "items": item(cat in ID_CATEGORIES)} for cat in categories},
+        "required": list(categories),
+        "additionalProperties": False,
+    }
+
+
+EXTRACTION_SCHEMA = category_schema()
@@ -0,0 +1,222 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+SPLIT_OUTPUTS = ("text_only.pdf", "images_only.pdf")
+RESULT_FILE = "result.json"
+# ChunkCache trims to this fraction of max_entries once it is over the limit
+CHUNK_EVICT_RATIO = 0.9
+
+
+def file_sha256(path, block_size=1 << 20):
+    """SHA-256 of a file, read in blocks so large PDFs are never fully in memory."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def link_or_copy(src, dst):
+    """Hardlinks src to dst (cheap, no extra disk), falling back to a copy."""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class DocumentCache:
+    """
+    Content-addressed cache of whole-document results.
+
+    An entry is keyed by the SHA-256 of the uploaded PDF plus the extraction
+    fingerprint (system prompt, model, chunker settings) and stores the two
+    split PDFs alongside the extraction result:
+
+        <root>/<key>/text_only.pdf
+        <root>/<key>/images_only.pdf
+        <root>/<key>/result.json
+
+    The index of entry sizes and last-access times is built by scanning the
+    root once and then kept up to date in memory. When the total size passes
+    `max_bytes`, the least recently used entries are removed.
+    """
+
+    def __init__(self, root, max_bytes=512 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._index = self._scan()
+
+    @staticmethod
+    def make_key(content_hash, fingerprint):
+        settings = json.dumps(fingerprint, sort_keys=True).encode("utf-8")
+        return hashlib.sha256(content_hash.encode("ascii") + b"|" + settings).hexdigest()
+
+    def get(self, key, dest_dir):
+        """
+        On a hit, links the cached split PDFs into dest_dir and returns the
+        stored extraction result. Returns None on a miss.
+        """
+        entry_dir = os.path.join(self.root, key)
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                return None
+            try:
+                with open(os.path.join(entry_dir, RESULT_FILE)) as f:
+                    result = json.load(f)
+                os.makedirs(dest_dir, exist_ok=True)
+                for name in SPLIT_OUTPUTS:
+                    link_or_copy(os.path.join(entry_dir, name), os.path.join(dest_dir, name))
+            except (OSError, ValueError) as e:
+                print(f"Warning: dropping unreadable cache entry {key}: {e}")
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            now = time.time()
+            os.utime(os.path.join(entry_dir, RESULT_FILE), (now, now))
+            self._index[key]["last_access"] = now
+            self.hits += 1
+            return result
+
+    def put(self, key, src_dir, result):
+        """Stores the split PDFs from src_dir and the extraction result under key."""
+        entry_dir = os.path.join(self.root, key)
+        tmp_dir = entry_dir + ".tmp"
+        with self._lock:
+            if key in self._index:
+                return
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            try:
+                for name in SPLIT_OUTPUTS:
+                    link_or_copy(os.path.join(src_dir, name), os.path.join(tmp_dir, name))
+                with open(os.path.join(tmp_dir, RESULT_FILE), "w") as f:
+                    json.dump(result, f)
+                os.replace(tmp_dir, entry_dir)
+            except OSError as e:
+                print(f"Warning: could not cache result {key}: {e}")
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return
+
+            self._index[key] = {"size": self._entry_size(entry_dir), "last_access": time.time()}
+            self._evict()
+
+    def stats(self):
+        """Entry count, size against the limit and hit/miss counts (shown on /health)."""
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "bytes": sum(e["size"] for e in self._index.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _evict(self):
+        total = sum(e["size"] for e in self._index.values())
+        for key in sorted(self._index, key=lambda k: self._index[k]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            total -= self._index[key]["size"]
+            self._remove(key)
+
+    def _remove(self, key):
+        shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+        self._index.pop(key, None)
+
+    def _scan(self):
+        index = {}
+        for name in os.listdir(self.root):
+            entry_dir = os.path.join(self.root, name)
+            result_path = os.path.join(entry_dir, RESULT_FILE)
+            if name.endswith(".tmp") or not os.path.exists(result_path):
+                # Leftover from an interrupted put()
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            index[name] = {
+                "size": self._entry_size(entry_dir),
+                "last_access": os.path.getmtime(result_path),
+            }
+        return index
+
+    @staticmethod
+    def _entry_size(entry_dir):
+        return sum(os.path.getsize(os.path.join(entry_dir, n)) for n in os.listdir(entry_dir))
+
+
+class ChunkCache:
+    """
+    Persistent cache of parsed per-chunk LLM results, stored in SQLite.
+
+    Keys are the SHA-256 of the chunk text plus the extraction settings
+    (system prompt, model, temperature), so a revised narrative only pays
+    for the chunks whose text actually changed. Each lookup refreshes the
+    entry's last-access time. The row count is kept in memory; once it
+    passes `max_entries`, the least recently used rows are deleted down to
+    CHUNK_EVICT_RATIO of the limit, so eviction runs once per many puts
+    instead of on every write.
+    """
+
+    def __init__(self, path, max_entries=20000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_lru ON chunks (last_access)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    @staticmethod
+    def make_key(chunk_text, settings):
+        digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8"))
+        digest.update(b"|")
+        digest.update(chunk_text.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM chunks WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE chunks SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        with self._lock:
+            row = (json.dumps(value), time.time(), key)
+            if self._conn.execute("UPDATE chunks SET value = ?, last_access = ? WHERE key = ?", row).rowcount == 0:
+                self._conn.execute("INSERT INTO chunks (value, last_access, key) VALUES (?, ?, ?)", row)
+                self._count += 1
+            if self._count > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._count
+
+    def _evict(self):
+        keep = int(self.max_entries * CHUNK_EVICT_RATIO)
+        self._count -= self._conn.execute(
+            "DELETE FROM chunks WHERE key IN ("
+            " SELECT key FROM chunks ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (keep,),
+        ).rowcount
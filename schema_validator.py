@@ -0,0 +1,56 @@
+"""
+Precompiled checks for the small JSON Schema subset used by prompts.py
+(type, properties, required, additionalProperties, items).
+
+`compile_validator(schema)` walks the schema once and returns a function of
+nested closures, so checking an LLM reply costs a few isinstance calls per
+item instead of interpreting the schema on every call.
+"""
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "boolean": bool,
+}
+
+
+def compile_validator(schema):
+    """Returns check(value) -> bool for `schema`."""
+    checks = []
+
+    expected = schema.get("type")
+    if expected is not None:
+        python_type = _TYPES[expected]
+        checks.append(lambda value: isinstance(value, python_type))
+
+    if "properties" in schema or "required" in schema:
+        properties = {name: compile_validator(sub) for name, sub in schema.get("properties", {}).items()}
+        required = tuple(schema.get("required", ()))
+        closed = schema.get("additionalProperties", True) is False
+
+        def check_object(value):
+            if not isinstance(value, dict):
+                return False
+            for name in required:
+                if name not in value:
+                    return False
+            for name, item in value.items():
+                check = properties.get(name)
+                if check is None:
+                    if closed:
+                        return False
+                elif not check(item):
+                    return False
+            return True
+        checks.append(check_object)
+
+    if "items" in schema:
+        check_item = compile_validator(schema["items"])
+        checks.append(lambda value: isinstance(value, list) and all(check_item(item) for item in value))
+
+    if len(checks) == 1:
+        return checks[0]
+    return lambda value: all(check(value) for check in checks)
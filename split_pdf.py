@@ -1,85 +1,281 @@
 import fitz
 import sys
 import os
+import tempfile
+import threading
+from concurrent.futures.process import BrokenProcessPool
+from metrics import span
 
-def split_pdf(input_path, output_folder=None):
+OUTPUT_TEXT = "text"
+OUTPUT_IMAGES = "images"
+
+# Page-parallel mode only pays off once the document is large enough to
+# outweigh shipping work to the worker processes
+PARALLEL_MIN_PAGES = 64
+# Page ranges per worker: a few smaller ranges balance image-heavy sections
+RANGES_PER_WORKER = 2
+
+_page_pool = None
+_page_pool_workers = 0
+_page_pool_lock = threading.Lock()
+
+def split_pdf(input_path, output_folder=None, outputs=(OUTPUT_TEXT, OUTPUT_IMAGES), with_text=False, workers=None):
+    """
+    Splits a PDF into text_only.pdf (raster images removed) and
+    images_only.pdf (only the raster images, on blank pages).
+
+    The source is opened once and walked page by page. Every unique image
+    xref is decoded once and embedded once in images_only.pdf, then reused
+    for each further placement, so repeated logos cost nothing extra.
+    `outputs` selects which files to produce; the path of a file that was
+    not requested (or failed) is returned as None.
+
+    With `with_text=True` the per-page text is read from the already open
+    document and returned as a third element, so callers can extract
+    entities without parsing text_only.pdf again.
+
+    With `workers` > 1 and at least PARALLEL_MIN_PAGES pages, the page range
+    is split across worker processes. Each opens the source on its own and
+    builds the images-only pages (and reads the text) for its range, while
+    this process writes text_only.pdf. The partial documents are stitched
+    in page order, so the output has the same pages, text and images as the
+    serial path. If a worker dies, the pool is replaced for the next split
+    and this document's pages are done in this process instead.
+    """
     if not os.path.exists(input_path):
         raise FileNotFoundError(f"File {input_path} not found.")
 
+    want_text = OUTPUT_TEXT in outputs
+    want_images = OUTPUT_IMAGES in outputs
+
     input_path = os.path.abspath(input_path)
     if output_folder:
         base_dir = output_folder
     else:
         base_dir = os.path.dirname(input_path)
-    
-    # Create output filename based on input filename to avoid collisions if needed, 
+
+    # Create output filename based on input filename to avoid collisions if needed,
     # but for this simple app, fixed names in a unique session folder might be better.
     # Let's stick to simple names for now, relying on the caller to manage folders.
-    text_output = os.path.join(base_dir, "text_only.pdf")
-    images_output = os.path.join(base_dir, "images_only.pdf")
+    text_output = os.path.join(base_dir, "text_only.pdf") if want_text else None
+    images_output = os.path.join(base_dir, "images_only.pdf") if want_images else None
+
+    page_texts = None
+    doc_src = fitz.open(input_path)
+    if workers and workers > 1 and doc_src.page_count >= PARALLEL_MIN_PAGES:
+        try:
+            page_texts, images_output = _split_parallel(doc_src, input_path, base_dir, text_output,
+                                                        images_output, with_text, workers)
+        finally:
+            doc_src.close()
+        if with_text:
+            return text_output, images_output, page_texts
+        return text_output, images_output
 
-    # Generate Text-Only PDF
-    # Strategy: Remove image objects (raster) but keep vector drawings (table lines).
-    try:
-        doc_text = fitz.open(input_path)
-        for page in doc_text:
-            # Get all images on the page
-            images = page.get_images(full=True)
-            for img in images:
-                xref = img[0]
-                page.delete_image(xref)
-        doc_text.save(text_output)
-        doc_text.close()
-    except Exception as e:
-        print(f"Error creating text_only.pdf: {e}")
-        text_output = None
-
-    # Generate Images-Only PDF
-    # Strategy: Create fresh pages and re-insert ONLY the images found in the original.
-    # This prevents table borders (vector drawings) and text residue from appearing.
     try:
-        doc_src = fitz.open(input_path)
-        doc_images = fitz.open() # New empty PDF
-        
-        for page in doc_src:
-            # Create a new page with the same dimensions
-            new_page = doc_images.new_page(width=page.rect.width, height=page.rect.height)
-            
-            # Get detailed image info including bounding boxes
-            image_infos = page.get_image_info(xrefs=True)
-            
-            for img in image_infos:
-                xref = img['xref']
-                bbox = fitz.Rect(img['bbox'])
-                
-                # Extract image data
-                try:
-                    # We can use the binary stream directly if possible, or extract
-                    img_data = doc_src.extract_image(xref)
-                    if img_data:
-                        # Insert content onto new page at exact location
-                        new_page.insert_image(bbox, stream=img_data["image"])
-                except Exception as img_err:
-                    print(f"Warning: Could not extract/insert image {xref}: {img_err}")
-                    
-        doc_images.save(images_output)
-        doc_images.close()
+        if with_text:
+            with span("text_extraction"):
+                page_texts = [page.get_text() for page in doc_src]
+
+        # Generate Images-Only PDF
+        # Strategy: Create fresh pages and re-insert ONLY the images found in the original.
+        # This prevents table borders (vector drawings) and text residue from appearing.
+        # Must run before the text pass below, which blanks the image streams.
+        if want_images:
+            try:
+                _write_images_only(doc_src, images_output)
+            except Exception as e:
+                print(f"Error creating images_only.pdf: {e}")
+                images_output = None
+
+        # Generate Text-Only PDF
+        # Strategy: Remove image objects (raster) but keep vector drawings (table lines).
+        if want_text:
+            try:
+                _remove_images(doc_src)
+                doc_src.save(text_output)
+            except Exception as e:
+                print(f"Error creating text_only.pdf: {e}")
+                text_output = None
+    finally:
         doc_src.close()
-    except Exception as e:
-        print(f"Error creating images_only.pdf: {e}")
-        # Fallback to redaction if reconstruction fails? 
-        # For now, let's assume reconstruction works or fail hard.
-        # But wait, we caught the exception.
-        images_output = None
-        
+
+    if with_text:
+        return text_output, images_output, page_texts
     return text_output, images_output
 
+def _split_parallel(doc_src, input_path, base_dir, text_output, images_output, with_text, workers):
+    """
+    Page-parallel split (see split_pdf). Returns (page_texts, images_output);
+    images_output is None if the images-only document failed.
+    """
+    page_count = doc_src.page_count
+    num_ranges = min(page_count, workers * RANGES_PER_WORKER)
+    bounds = [page_count * i // num_ranges for i in range(num_ranges + 1)]
+    ranges = list(zip(bounds[:-1], bounds[1:]))
+
+    with tempfile.TemporaryDirectory(dir=base_dir, prefix=".split-") as parts_dir:
+        pool = _get_page_pool(workers)
+        try:
+            futures = [
+                pool.submit(_split_range, input_path, start, stop,
+                            os.path.join(parts_dir, f"images-{i:04d}.pdf") if images_output else None, with_text)
+                for i, (start, stop) in enumerate(ranges)
+            ]
+        except BrokenProcessPool:
+            futures = None
+
+        # text_only.pdf is one cheap pass (each image stream is blanked once),
+        # written here while the workers rebuild the images
+        if text_output:
+            try:
+                _remove_images(doc_src)
+                doc_src.save(text_output)
+            except Exception as e:
+                print(f"Error creating text_only.pdf: {e}")
+                text_output = None
+
+        results = None
+        if futures is not None:
+            try:
+                results = [future.result() for future in futures]
+            except BrokenProcessPool as e:
+                print(f"Page workers failed: {e}")
+        if results is None:
+            # A worker died (killed, out of memory): drop the pool so the next
+            # split starts fresh ones, and do this document's ranges in-process
+            print(f"Splitting {os.path.basename(input_path)} serially")
+            _discard_page_pool(pool)
+            results = [_split_range(input_path, 0, page_count,
+                                    os.path.join(parts_dir, "images-serial.pdf") if images_output else None,
+                                    with_text)]
+        # The text was read by the workers, inside the split time
+        page_texts = [text for texts, _ in results for text in texts] if with_text else None
+
+        if images_output:
+            try:
+                doc_images = fitz.open()
+                for _, part_path in results:
+                    if part_path is None:
+                        raise RuntimeError("a page range failed")
+                    with fitz.open(part_path) as part:
+                        doc_images.insert_pdf(part)
+                # garbage=4 merges identical image streams embedded by several ranges
+                doc_images.save(images_output, garbage=4, deflate=True)
+                doc_images.close()
+            except Exception as e:
+                print(f"Error creating images_only.pdf: {e}")
+                images_output = None
+    return page_texts, images_output
+
+def _split_range(input_path, start, stop, images_path, with_text):
+    """
+    Worker task: images-only pages and page text for pages [start, stop).
+    Returns (page_texts, images_path); images_path is None on failure.
+    """
+    doc_src = fitz.open(input_path)
+    try:
+        page_texts = [doc_src[i].get_text() for i in range(start, stop)] if with_text else []
+        if images_path:
+            try:
+                _write_images_only(doc_src, images_path, start, stop)
+            except Exception as e:
+                print(f"Error creating images for pages {start + 1}-{stop}: {e}")
+                images_path = None
+    finally:
+        doc_src.close()
+    return page_texts, images_path
+
+def _get_page_pool(workers):
+    """Shared worker pool for page-parallel splits (spawned: callers may be threaded)."""
+    global _page_pool, _page_pool_workers
+    with _page_pool_lock:
+        if _page_pool is None or _page_pool_workers != workers:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            if _page_pool is not None:
+                _page_pool.shutdown(wait=False)
+            _page_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _page_pool_workers = workers
+        return _page_pool
+
+def _discard_page_pool(pool):
+    """Forgets a broken worker pool (if it is still the shared one)."""
+    global _page_pool, _page_pool_workers
+    with _page_pool_lock:
+        if _page_pool is pool:
+            _page_pool = None
+            _page_pool_workers = 0
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _write_images_only(doc_src, images_output, start=0, stop=None):
+    doc_images = fitz.open() # New empty PDF
+    # source xref -> xref of the copy already embedded in doc_images (None if unusable)
+    embedded = {}
+
+    for page in doc_src.pages(start, stop):
+        # Create a new page with the same dimensions
+        new_page = doc_images.new_page(width=page.rect.width, height=page.rect.height)
+
+        # Get detailed image info including bounding boxes
+        for img in page.get_image_info(xrefs=True):
+            xref = img['xref']
+            if not xref:
+                # Inline image without an xref - nothing to extract
+                continue
+            bbox = fitz.Rect(img['bbox'])
+
+            try:
+                if xref in embedded:
+                    if embedded[xref]:
+                        # Reuse the image object already stored in the output
+                        new_page.insert_image(bbox, xref=embedded[xref])
+                    continue
+
+                # First placement of this xref: decode once and embed
+                embedded[xref] = None
+                img_data = doc_src.extract_image(xref)
+                if img_data:
+                    # Insert content onto new page at exact location
+                    embedded[xref] = new_page.insert_image(bbox, stream=img_data["image"])
+            except Exception as img_err:
+                print(f"Warning: Could not extract/insert image {xref}: {img_err}")
+
+    doc_images.save(images_output, garbage=1, deflate=True)
+    doc_images.close()
+
+def _remove_images(doc):
+    # Blanking an image replaces its shared stream, so each xref only needs
+    # to be removed once, on the first page that uses it.
+    removed = set()
+    for page in doc:
+        # Get all images on the page
+        for img in page.get_images(full=True):
+            xref = img[0]
+            if xref in removed:
+                continue
+            page.delete_image(xref)
+            removed.add(xref)
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python split_pdf.py <input_pdf>")
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    flags = [a for a in sys.argv[1:] if a.startswith("--")]
+    if len(args) < 1:
+        print("Usage: python split_pdf.py <input_pdf> [--text-only | --images-only] [--workers=N]")
         sys.exit(1)
-    
-    input_file = sys.argv[1]
-    t, i = split_pdf(input_file)
+
+    workers = None
+    for flag in flags:
+        if flag.startswith("--workers="):
+            workers = int(flag.split("=", 1)[1])
+
+    outputs = (OUTPUT_TEXT, OUTPUT_IMAGES)
+    if "--text-only" in flags:
+        outputs = (OUTPUT_TEXT,)
+    elif "--images-only" in flags:
+        outputs = (OUTPUT_IMAGES,)
+
+    input_file = args[0]
+    t, i = split_pdf(input_file, outputs=outputs, workers=workers)
     print(f"Text PDF: {t}")
     print(f"Images PDF: {i}")
@@ -0,0 +1,216 @@
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+from result_cache import file_sha256
+
+
+class SessionStorage:
+    """
+    Disk manager for the uploads/<session> and processed/<session> folders.
+
+    Every file in a session folder is a hardlink to a content-addressed blob
+    (<state_root>/blobs/<sha256>), so identical uploads and identical split
+    outputs occupy disk once. A SQLite index tracks blob sizes, reference
+    counts and per-session last access, which keeps the total size known
+    without walking the folders. When the blobs exceed `max_bytes`, the
+    least recently used sessions are deleted together with any blobs no
+    longer referenced. Sessions still being processed are never evicted.
+    """
+
+    def __init__(self, upload_root, output_root, state_root, max_bytes=2 * 1024 ** 3):
+        self.upload_root = upload_root
+        self.output_root = output_root
+        self.blob_root = os.path.join(state_root, "blobs")
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        self._active = set()
+        for path in (upload_root, output_root, self.blob_root):
+            os.makedirs(path, exist_ok=True)
+
+        self._conn = sqlite3.connect(os.path.join(state_root, "index.sqlite3"), check_same_thread=False)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " id TEXT PRIMARY KEY, last_access REAL NOT NULL, extra_bytes INTEGER NOT NULL DEFAULT 0);"
+            "CREATE TABLE IF NOT EXISTS session_files ("
+            " session_id TEXT NOT NULL, path TEXT NOT NULL, hash TEXT NOT NULL,"
+            " PRIMARY KEY (session_id, path));"
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            " hash TEXT PRIMARY KEY, size INTEGER NOT NULL, refs INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS sessions_lru ON sessions (last_access);"
+        )
+        self._conn.commit()
+        self._adopt_unindexed_sessions()
+
+    # --- Public API ---
+
+    def create_session(self, upload, filename):
+        """
+        Saves an upload (anything with a werkzeug-style .save(path)) into a
+        new session. Returns (session_id, file_path, sha256 of the content).
+        The session is pinned against eviction until commit_outputs().
+        """
+        session_id = str(uuid.uuid4())
+        upload_dir = os.path.join(self.upload_root, session_id)
+        os.makedirs(upload_dir, exist_ok=True)
+        os.makedirs(os.path.join(self.output_root, session_id), exist_ok=True)
+
+        file_path = os.path.join(upload_dir, os.path.basename(filename))
+        upload.save(file_path)
+
+        with self._lock:
+            self._active.add(session_id)
+            self._conn.execute("INSERT INTO sessions (id, last_access) VALUES (?, ?)",
+                               (session_id, time.time()))
+            content_hash = self._store_file(session_id, file_path)
+            self._conn.commit()
+        return session_id, file_path, content_hash
+
+    def output_dir(self, session_id):
+        return os.path.join(self.output_root, session_id)
+
+    def commit_outputs(self, session_id):
+        """Dedups the session's processed files into the blob store and unpins it."""
+        output_dir = self.output_dir(session_id)
+        with self._lock:
+            if os.path.isdir(output_dir):
+                for name in os.listdir(output_dir):
+                    self._store_file(session_id, os.path.join(output_dir, name))
+            self._active.discard(session_id)
+            self._conn.commit()
+            self._evict()
+
+    def output_path(self, session_id, filename):
+        """Path of a processed file, or None if unknown/evicted. Counts as an access."""
+        path = os.path.join(self.output_dir(os.path.basename(session_id)), os.path.basename(filename))
+        if not os.path.isfile(path):
+            return None
+        self.touch(session_id)
+        return path
+
+    def touch(self, session_id):
+        with self._lock:
+            self._conn.execute("UPDATE sessions SET last_access = ? WHERE id = ?", (time.time(), session_id))
+            self._conn.commit()
+
+    def stats(self):
+        """Session and blob counts and the stored bytes against the quota (shown on /health)."""
+        with self._lock:
+            sessions = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            blobs = self._conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
+            return {
+                "sessions": sessions,
+                "blobs": blobs,
+                "bytes": self._total_bytes(),
+                "max_bytes": self.max_bytes,
+                "active": len(self._active),
+            }
+
+    # --- Internals (callers hold self._lock) ---
+
+    def _store_file(self, session_id, path):
+        """Replaces `path` with a hardlink to its content blob and records the reference."""
+        path = os.path.abspath(path)
+        known = self._conn.execute("SELECT hash FROM session_files WHERE session_id = ? AND path = ?",
+                                   (session_id, path)).fetchone()
+        if known:
+            return known[0]
+
+        content_hash = file_sha256(path)
+        blob_path = os.path.join(self.blob_root, content_hash)
+        size = os.path.getsize(path)
+
+        if self._conn.execute("SELECT 1 FROM blobs WHERE hash = ?", (content_hash,)).fetchone():
+            self._conn.execute("UPDATE blobs SET refs = refs + 1 WHERE hash = ?", (content_hash,))
+        else:
+            self._conn.execute("INSERT INTO blobs (hash, size, refs) VALUES (?, ?, 1)", (content_hash, size))
+
+        if not os.path.exists(blob_path):
+            try:
+                os.link(path, blob_path)
+            except OSError:
+                shutil.copy2(path, blob_path)
+        elif not os.path.samefile(path, blob_path):
+            # Identical content already stored: swap our copy for a link to the blob
+            tmp_path = path + ".link"
+            try:
+                os.link(blob_path, tmp_path)
+                os.replace(tmp_path, path)
+            except OSError:
+                # Cross-device or no hardlink support: keep the copy but account for it
+                self._conn.execute("UPDATE sessions SET extra_bytes = extra_bytes + ? WHERE id = ?",
+                                   (size, session_id))
+
+        self._conn.execute("INSERT INTO session_files (session_id, path, hash) VALUES (?, ?, ?)",
+                           (session_id, path, content_hash))
+        return content_hash
+
+    def _total_bytes(self):
+        blob_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        extra_bytes = self._conn.execute("SELECT COALESCE(SUM(extra_bytes), 0) FROM sessions").fetchone()[0]
+        return blob_bytes + extra_bytes
+
+    def _evict(self):
+        total = self._total_bytes()
+        if total <= self.max_bytes:
+            return
+        for (session_id,) in self._conn.execute("SELECT id FROM sessions ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            if session_id in self._active:
+                continue
+            print(f"Storage quota exceeded, evicting session {session_id}")
+            self._delete_session(session_id)
+            total = self._total_bytes()
+        self._conn.commit()
+
+    def _delete_session(self, session_id):
+        shutil.rmtree(os.path.join(self.upload_root, session_id), ignore_errors=True)
+        shutil.rmtree(os.path.join(self.output_root, session_id), ignore_errors=True)
+
+        hashes = [h for (h,) in self._conn.execute(
+            "SELECT hash FROM session_files WHERE session_id = ?", (session_id,))]
+        for content_hash in hashes:
+            self._conn.execute("UPDATE blobs SET refs = refs - 1 WHERE hash = ?", (content_hash,))
+        for (content_hash,) in self._conn.execute("SELECT hash FROM blobs WHERE refs <= 0").fetchall():
+            try:
+                os.remove(os.path.join(self.blob_root, content_hash))
+            except FileNotFoundError:
+                pass
+            self._conn.execute("DELETE FROM blobs WHERE hash = ?", (content_hash,))
+
+        self._conn.execute("DELETE FROM session_files WHERE session_id = ?", (session_id,))
+        self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def _adopt_unindexed_sessions(self):
+        """
+        One-time migration of session folders created before the index
+        existed: their files are deduplicated into the blob store and the
+        folder mtime becomes the last access time.
+        """
+        with self._lock:
+            known = {sid for (sid,) in self._conn.execute("SELECT id FROM sessions")}
+            folders = set(os.listdir(self.upload_root)) | set(os.listdir(self.output_root))
+            adopted = 0
+            for session_id in sorted(folders - known):
+                dirs = [os.path.join(root, session_id) for root in (self.upload_root, self.output_root)]
+                dirs = [d for d in dirs if os.path.isdir(d)]
+                if not dirs:
+                    continue
+                last_access = max(os.path.getmtime(d) for d in dirs)
+                self._conn.execute("INSERT INTO sessions (id, last_access) VALUES (?, ?)",
+                                   (session_id, last_access))
+                for d in dirs:
+                    for name in os.listdir(d):
+                        path = os.path.join(d, name)
+                        if os.path.isfile(path):
+                            self._store_file(session_id, path)
+                adopted += 1
+            self._conn.commit()
+            if adopted:
+                print(f"Storage: indexed {adopted} existing session folders")
+            self._evict()
+
@@ -0,0 +1,111 @@
+"""
+Deterministic tag scanner run before the LLM.
+
+Control narratives name their equipment and signals with regular tags
+(SV01, P-101, FT-201.IN, XV-301.Close). One compiled regex finds them in a
+single pass; a second compiled alternation (built as a prefix trie, so
+matching does not try every keyword in turn) spots control vocabulary in
+text without tags. Chunks with neither are boilerplate (revision tables,
+headers, contents) and skip the model; chunks with tags pass them to the
+model as known IDs.
+"""
+import re
+
+# Letters, an optional dash, digits, optional suffix letter and an optional
+# ".Attribute": SV01, P-101, FT-201.IN, XV-301.Close, SUSV-110. Quarters
+# (Q3), standards (ISO9001, IEC-61131) and versions (V1.0) have the same
+# shape and are excluded.
+_NOT_A_TAG = r"(?!Q[1-4]\b)(?!(?:ISO|IEC|IEEE|ANSI|ASME|ASTM|NFPA|DIN|ISA)-?\d)"
+TAG_RE = re.compile(r"\b" + _NOT_A_TAG + r"[A-Z]{1,5}-?\d{1,4}[A-Z]?(?:\.[A-Za-z]{1,10})?\b(?!\.\d)")
+
+# Base forms; plurals and -s/-ed/-ing forms are matched too (pumps, stopped)
+CONTROL_KEYWORDS = (
+    "alarm", "abort", "actuator", "analyzer", "close", "conductivity", "deadband", "divert",
+    "enable", "disable", "feed", "flow", "heater", "hold", "interlock", "level", "limit", "motor",
+    "open", "pause", "permissive", "ph", "pressure", "pump", "ramp", "setpoint",
+    "shutdown", "speed", "start", "startup", "stop", "switch", "tank", "temperature", "timer", "totalizer",
+    "transmitter", "trip", "valve", "vessel", "weight",
+)
+# Distinct control keywords needed for a chunk without tags to go to the LLM
+MIN_KEYWORDS = 2
+
+
+def _inflections(word):
+    """Regular inflected forms of a keyword (a few impossible ones are harmless)."""
+    forms = {word, word + "s", word + "es", word + "ed", word + "ing"}
+    if word.endswith("e"):
+        # close -> closed, closing
+        forms |= {word + "d", word[:-1] + "ing"}
+    if re.fullmatch(r".*[^aeiou][aeiou][bdglmnprt]", word):
+        # stop -> stopped, stopping
+        forms |= {word + word[-1] + "ed", word + word[-1] + "ing"}
+    return forms
+
+
+# Inflected form -> base keyword, so "pump" and "pumps" count once
+KEYWORD_FORMS = {form: word for word in CONTROL_KEYWORDS for form in _inflections(word)}
+
+
+def _trie_pattern(words):
+    """Builds a regex alternation shaped like a prefix trie of `words`."""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        end = "" in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if end else body
+
+    return build(trie)
+
+
+KEYWORD_RE = re.compile(r"\b" + _trie_pattern(KEYWORD_FORMS) + r"\b", re.IGNORECASE)
+
+
+def find_tags(text):
+    """Unique tags in order of first appearance."""
+    return list(dict.fromkeys(TAG_RE.findall(text)))
+
+
+def has_control_signal(text, tags=None):
+    """True if the text has a tag or enough control vocabulary to be worth an LLM call."""
+    if tags is None:
+        tags = find_tags(text)
+    if tags:
+        return True
+    keywords = set()
+    for match in KEYWORD_RE.finditer(text):
+        keywords.add(KEYWORD_FORMS[match.group(0).lower()])
+        if len(keywords) >= MIN_KEYWORDS:
+            return True
+    return False
+
+
+class TagIndex:
+    """Every tag occurrence in a document as (page number, character offset in the page)."""
+
+    def __init__(self):
+        self.occurrences = {}
+
+    def add_page(self, page_number, text):
+        for match in TAG_RE.finditer(text):
+            self.occurrences.setdefault(match.group(0), []).append((page_number, match.start()))
+
+    def scan_pages(self, pages):
+        """Indexes a page stream while passing the pages through unchanged (pages count from 1)."""
+        for page_number, text in enumerate(pages, start=1):
+            self.add_page(page_number, text)
+            yield text
+
+    def to_dict(self):
+        return {tag: [list(occurrence) for occurrence in found] for tag, found in self.occurrences.items()}
+
+    def __len__(self):
+        return len(self.occurrences)
@@ -0,0 +1,41 @@
+from chunking import _iter_lines, estimate_tokens, iter_structured_chunks
+
+
+def _page(number, total, body):
+    return f"ACME Water Treatment - Control Narrative\n{body}\nPage {number} of {total}"
+
+
+def test_running_header_and_footer_are_dropped():
+    pages = [_page(n, 4, f"Step {n}: open SV0{n}.") for n in range(1, 5)]
+    lines = [line for line in _iter_lines(pages) if line]
+    assert lines == ["Step 1: open SV01.", "Step 2: open SV02.", "Step 3: open SV03.", "Step 4: open SV04."], lines
+    print("Running lines: header and page footer dropped on every page")
+
+
+def test_numbered_heading_at_page_top_survives():
+    # Consecutive pages open with sibling sections that only differ in their number
+    pages = [f"2.5.2.3.{n} Startup\nStart P-10{n} when LT-200 is above 40 %." for n in range(1, 5)]
+    lines = [line for line in _iter_lines(pages) if line]
+    for n in range(1, 5):
+        assert f"2.5.2.3.{n} Startup" in lines, lines
+        assert f"Start P-10{n} when LT-200 is above 40 %." in lines, lines
+
+    chunks = list(iter_structured_chunks(pages, max_tokens=200, overlap_tokens=8, count_tokens=estimate_tokens))
+    text = "\n".join(chunks)
+    assert all(f"2.5.2.3.{n} Startup" in text for n in range(1, 5)), chunks
+    print("Running lines: numbered headings at the top of consecutive pages kept")
+
+
+def test_line_on_two_pages_is_kept():
+    # Repeats at a page edge twice only: real content, not a running header
+    pages = ["Feed pump P-101 starts.\nDetails one.", "Feed pump P-101 starts.\nDetails two.", "Other page."]
+    lines = [line for line in _iter_lines(pages) if line]
+    assert lines.count("Feed pump P-101 starts.") == 2, lines
+    print("Running lines: a line repeated on two pages is kept")
+
+
+if __name__ == "__main__":
+    test_running_header_and_footer_are_dropped()
+    test_numbered_heading_at_page_top_survives()
+    test_line_on_two_pages_is_kept()
+    print("\nSUCCESS: only lines repeating on many pages are treated as running headers/footers.")
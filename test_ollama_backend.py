@@ -0,0 +1,280 @@
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import prompts
+import tinyllama_service
+from mock_ollama import MockOllamaServer, TOKEN_RE, default_responder
+from prompts import BALANCED_SYSTEM_PROMPT
+from result_cache import ChunkCache
+from split_pdf import split_pdf
+
+SAMPLE_PDF = os.path.join("ml_prototype", "sample_1_susv.pdf")
+
+
+def _use_server(server):
+    # Point the shared client at the mock server
+    tinyllama_service.OLLAMA_HOST = server.url
+    tinyllama_service._llm = None
+
+
+def test_preload_warms_system_prompt():
+    with MockOllamaServer(prompt_ms_per_token=0.1) as server:
+        _use_server(server)
+        tinyllama_service.preload_llm()
+
+        load, warm = server.requests
+        assert load["messages"] == [], "first request should only load the model"
+        assert load["keep_alive"] == tinyllama_service.OLLAMA_KEEP_ALIVE
+        assert warm["messages"][0] == {"role": "system", "content": BALANCED_SYSTEM_PROMPT}
+        assert warm["options"]["num_predict"] == 1
+        print("Preload: model loaded and system prompt evaluated once")
+
+
+def test_system_prompt_prefix_is_reused():
+    with MockOllamaServer(prompt_ms_per_token=0.1) as server:
+        _use_server(server)
+        tinyllama_service.preload_llm()
+        with tempfile.TemporaryDirectory() as output_dir:
+            _, _, page_texts = split_pdf(SAMPLE_PDF, output_folder=output_dir, with_text=True)
+        result = tinyllama_service.extract_entities_ollama(SAMPLE_PDF, use_cache=False, pages=page_texts)
+
+        assert "error" not in result, result
+        chunk_requests = server.requests[2:]
+        assert len(chunk_requests) == result["chunking"]["chunks"]
+        for request in chunk_requests:
+            system, user = request["messages"]
+            assert system == {"role": "system", "content": BALANCED_SYSTEM_PROMPT}
+            assert user["role"] == "user" and user["content"].startswith("DATA TO EXTRACT:")
+            assert BALANCED_SYSTEM_PROMPT not in user["content"]
+            assert request["keep_alive"] == tinyllama_service.OLLAMA_KEEP_ALIVE
+
+        # With the prefix cached only the chunk is evaluated
+        timing = result["llm_timing"]
+        system_tokens = len(TOKEN_RE.findall(BALANCED_SYSTEM_PROMPT))
+        assert timing["calls"] == len(chunk_requests)
+        assert timing["prompt_eval_tokens"] < system_tokens * timing["calls"], timing
+        assert any(item["id"] == "SUSV-110" for item in result["equipment"]), result["equipment"]
+        print(f"Extraction: {timing['calls']} calls, {timing['prompt_eval_tokens']} prompt tokens evaluated "
+              f"(system prompt alone is {system_tokens})")
+
+
+def test_llm_timing_is_per_document():
+    # Two documents extracted at once share the client; each reports its own calls
+    documents = {
+        "one.pdf": ["Open XV-101 when P-101 starts."],
+        "two.pdf": [f"Stop P-20{n} when LT-20{n} is low." for n in range(3)],
+    }
+    with MockOllamaServer(latency_ms=20) as server:
+        _use_server(server)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = dict(zip(documents, executor.map(
+                lambda name: tinyllama_service.extract_entities_ollama(
+                    name, use_cache=False, pages=documents[name]), documents)))
+    for name, result in results.items():
+        assert result["llm_timing"]["calls"] == result["chunking"]["chunks"], (name, result["llm_timing"])
+    assert sum(result["llm_timing"]["calls"] for result in results.values()) == len(server.requests)
+    print("LLM timing: concurrent documents each report only their own calls")
+
+def test_tag_prescan_skips_boilerplate():
+    revisions = "Revision History\nRevision Number\nDate\nDescription of Changes\n1\nMay 31, 2023\nOriginal Version"
+    startup = "2.5.2.3.1  Startup\nIf LT-101 is above the low limit, then open XV-301.Close and start P-101."
+    with MockOllamaServer() as server:
+        _use_server(server)
+        skipped = tinyllama_service.extract_entities_ollama("revisions.pdf", use_cache=False, pages=[revisions])
+        assert skipped["tags"]["llm_calls_avoided"] == skipped["chunking"]["chunks"] == 1, skipped["tags"]
+        assert server.requests == []
+
+        result = tinyllama_service.extract_entities_ollama("startup.pdf", use_cache=False,
+                                                           pages=[revisions, startup])
+    assert result["tags"]["index"]["P-101"] == [[2, startup.index("P-101")]]
+    assert len(server.requests) == result["chunking"]["chunks"] - result["tags"]["llm_calls_avoided"]
+    assert server.requests[-1]["messages"][1]["content"].endswith(
+        "IDS FOUND IN THIS TEXT: LT-101, XV-301.Close, P-101")
+    assert {item["id"] for item in result["equipment"]} == {"LT-101", "XV-301.Close", "P-101"}
+    print("Tag pre-scan: revision table skipped, tags indexed and passed to the model")
+
+
+def _collapsing_responder(messages, request):
+    # First answer: conditions only. Follow-up turn: the equipment it missed.
+    if len(messages) > 2:
+        return default_responder(messages[1:2], request)
+    return json.dumps({"conditions": [{"name": "High level", "description": "If LT-101 is above the limit"}]})
+
+
+def test_collapse_reasks_missing_categories():
+    text = "If LT-101 is above the high limit, then close XV-301.Close and stop P-101."
+    with MockOllamaServer(latency_ms=20, responder=_collapsing_responder) as server:
+        _use_server(server)
+        result = tinyllama_service.extract_entities_ollama("collapse.pdf", use_cache=False, pages=[text])
+
+        first, followup = server.requests
+        assert followup["messages"][:2] == first["messages"]
+        assert followup["messages"][2]["role"] == "assistant"
+        assert "equipment, parameters, variables" in followup["messages"][3]["content"]
+        assert text not in followup["messages"][3]["content"]
+
+        reask = result["collapse_reask"]
+        assert reask["reasks"] == 1 and reask["recovered_items"] == 3, reask
+        assert {item["id"] for item in result["equipment"]} == {"LT-101", "XV-301.Close", "P-101"}
+        assert [item["name"] for item in result["conditions"]] == ["High level"]
+
+        # With the budget spent, the conditions-only answer is kept as is,
+        # but not cached: the next run gets the full answer
+        original = tinyllama_service.REASK_BUDGET_SECONDS
+        tinyllama_service.REASK_BUDGET_SECONDS = 0
+        with tempfile.TemporaryDirectory() as cache_dir:
+            tinyllama_service._chunk_cache = ChunkCache(os.path.join(cache_dir, "chunks.sqlite3"))
+            try:
+                capped = tinyllama_service.extract_entities_ollama("collapse.pdf", pages=[text])
+                tinyllama_service.REASK_BUDGET_SECONDS = original
+                rerun = tinyllama_service.extract_entities_ollama("collapse.pdf", pages=[text])
+            finally:
+                tinyllama_service.REASK_BUDGET_SECONDS = original
+                tinyllama_service._chunk_cache = None
+        assert capped["collapse_reask"]["skipped_over_budget"] == 1 and capped["equipment"] == []
+        assert rerun["chunk_cache"]["hits"] == 0 and len(server.requests) == 5
+        assert rerun["equipment"] == result["equipment"]
+    print(f"Collapse re-ask: {reask['recovered_items']} items recovered in {reask['seconds']}s")
+
+
+def _broken_pump_responder(messages, request):
+    # Never valid JSON for the chunk about P-201; the other chunks answer normally
+    if "P-201" in messages[-1]["content"]:
+        return "Sorry, I cannot help with that."
+    return default_responder(messages, request)
+
+
+def test_failed_chunks_are_reported():
+    pages = ["Start P-101 when LT-101 is above the low limit and keep XV-101 open while the tank fills.",
+             "Stop P-201 when LT-201 is below the low limit and close XV-201 before the tank drains."]
+    original = tinyllama_service.CHUNK_MAX_TOKENS
+    tinyllama_service.CHUNK_MAX_TOKENS = 50
+    try:
+        with MockOllamaServer(responder=_broken_pump_responder) as server:
+            _use_server(server)
+            partial = tinyllama_service.extract_entities_ollama("partial.pdf", use_cache=False, pages=pages)
+        assert partial["chunking"]["chunks"] == 2, partial["chunking"]
+        assert partial["failed_chunks"] == 1 and "error" not in partial, partial
+        assert {item["id"] for item in partial["equipment"]} == {"P-101", "LT-101", "XV-101"}
+
+        # Every LLM-bound chunk failed: an error, not an empty extraction
+        tinyllama_service.OLLAMA_HOST = "http://127.0.0.1:9"
+        tinyllama_service._llm = None
+        down = tinyllama_service.extract_entities_ollama("down.pdf", use_cache=False, pages=pages)
+        assert "error" in down and down["failed_chunks"] == 2, down
+    finally:
+        tinyllama_service.CHUNK_MAX_TOKENS = original
+    print(f"Failed chunks: partial result flags 1 failed chunk, an outage returns '{down['error']}'")
+
+class _BrokenCache:
+    # Chunk cache that fails on the chunk about P-201
+    def get(self, key):
+        return None
+
+    def put(self, key, value):
+        if value["equipment"] and value["equipment"][0]["id"] == "P-201":
+            raise RuntimeError("disk I/O error")
+
+
+def _unreadable_pages():
+    yield "Start P-101 when LT-101 is above the low limit."
+    raise ValueError("broken xref table")
+
+
+def test_worker_errors_fail_the_chunk():
+    pages = ["Start P-101 when LT-101 is above the low limit and keep XV-101 open while the tank fills.",
+             "Stop P-201 when LT-201 is below the low limit and close XV-201 before the tank drains."]
+    original = tinyllama_service.CHUNK_MAX_TOKENS
+    tinyllama_service.CHUNK_MAX_TOKENS = 50
+    tinyllama_service._chunk_cache = _BrokenCache()
+    chunk_events = []
+    try:
+        with MockOllamaServer() as server:
+            _use_server(server)
+            result = tinyllama_service.extract_entities_ollama(
+                "worker.pdf", pages=pages, on_chunk=lambda index, items, hit: chunk_events.append((index, items)))
+            unreadable = tinyllama_service.extract_entities_ollama("unreadable.pdf", use_cache=False,
+                                                                   pages=_unreadable_pages())
+    finally:
+        tinyllama_service.CHUNK_MAX_TOKENS = original
+        tinyllama_service._chunk_cache = None
+    assert result["failed_chunks"] == 1 and "error" not in result, result
+    assert sorted(index for index, items in chunk_events if items is None) == [1], chunk_events
+    assert unreadable["error"].startswith("PDF Reading Error: broken xref table"), unreadable
+    print("Worker errors: a failing chunk worker fails its chunk, a page read error fails the document")
+
+def test_failed_extraction_is_not_cached():
+    os.environ.setdefault("LOAD_LAYOUTLM", "0")
+    os.environ.setdefault("PRELOAD_OLLAMA", "0")
+    import app
+    from result_cache import DocumentCache
+
+    def run_job(output_dir):
+        os.makedirs(output_dir)
+        return app._run_split_pipeline("session", SAMPLE_PDF, output_dir, "cache-key", lambda event, data=None: None)
+
+    original_cache = app.document_cache
+    original_budget = tinyllama_service.REASK_BUDGET_SECONDS
+    with tempfile.TemporaryDirectory() as root:
+        app.document_cache = DocumentCache(os.path.join(root, "cache"))
+        try:
+            # Ollama unreachable: every chunk fails
+            tinyllama_service.OLLAMA_HOST = "http://127.0.0.1:9"
+            tinyllama_service._llm = None
+            down = run_job(os.path.join(root, "down"))["extraction_result"]
+            assert down.get("failed_chunks") == 1, down
+
+            # Conditions-only answers kept without their re-ask: incomplete
+            tinyllama_service.REASK_BUDGET_SECONDS = 0
+            with MockOllamaServer(responder=_collapsing_responder) as server:
+                _use_server(server)
+                capped = run_job(os.path.join(root, "capped"))["extraction_result"]
+            assert capped["incomplete_chunks"] == 1 and "error" not in capped, capped
+            assert app.document_cache.stats()["entries"] == 0
+        finally:
+            app.document_cache = original_cache
+            tinyllama_service.REASK_BUDGET_SECONDS = original_budget
+    print("Document cache: failed and incomplete extractions are not stored")
+
+def _markdown_responder(messages, request):
+    # Free-text style reply: the JSON wrapped in a markdown code block
+    return "Here is the result:\n```json\n" + default_responder(messages, request) + "\n```"
+
+
+def test_schema_output_skips_repair():
+    text = "If LT-101 is above the high limit, then close XV-301.Close and stop P-101."
+    with MockOllamaServer() as server:
+        _use_server(server)
+        result = tinyllama_service.extract_entities_ollama("schema.pdf", use_cache=False, pages=[text])
+    request = server.requests[0]
+    assert request["format"] == prompts.EXTRACTION_SCHEMA
+    assert result["llm_parse"]["valid"] == 1 and result["llm_parse"]["repaired"] == 0, result["llm_parse"]
+
+    original = tinyllama_service.OLLAMA_FORMAT
+    tinyllama_service.OLLAMA_FORMAT = "none"
+    try:
+        with MockOllamaServer(responder=_markdown_responder) as server:
+            _use_server(server)
+            free = tinyllama_service.extract_entities_ollama("schema.pdf", use_cache=False, pages=[text])
+    finally:
+        tinyllama_service.OLLAMA_FORMAT = original
+        tinyllama_service._llm = None
+    assert "format" not in server.requests[0]
+    assert free["llm_parse"]["repaired"] == 1, free["llm_parse"]
+    assert free["equipment"] == result["equipment"]
+    print("Schema output: valid replies parsed without the repair path")
+
+
+if __name__ == "__main__":
+    test_preload_warms_system_prompt()
+    test_system_prompt_prefix_is_reused()
+    test_llm_timing_is_per_document()
+    test_tag_prescan_skips_boilerplate()
+    test_collapse_reasks_missing_categories()
+    test_failed_chunks_are_reported()
+    test_worker_errors_fail_the_chunk()
+    test_failed_extraction_is_not_cached()
+    test_schema_output_skips_repair()
+    print("\nSUCCESS: Ollama backend sends a stable system message and reuses its prefix.")
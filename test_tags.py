@@ -0,0 +1,46 @@
+from tags import TagIndex, find_tags, has_control_signal
+
+
+def test_tags_found():
+    text = "Open XV-301.Close, then start P-101 and SUSV-110. FT-201.IN feeds SV01; V2 stays shut."
+    assert find_tags(text) == ["XV-301.Close", "P-101", "SUSV-110", "FT-201.IN", "SV01", "V2"], find_tags(text)
+    print("Tags: equipment and signal tags found")
+
+
+def test_versions_standards_and_quarters_are_not_tags():
+    text = "Revision V1.0 (V12.4 draft) follows ISO9001, ISO-9001, IEC61131 and ISA-88, issued in Q3."
+    assert find_tags(text) == [], find_tags(text)
+    assert not has_control_signal(text)
+    print("Tags: versions, standards and quarters ignored")
+
+
+def test_inflected_keywords_count():
+    text = "The pumps are stopped and the heaters are switched off when the tanks drain."
+    assert find_tags(text) == []
+    assert has_control_signal(text)
+    assert has_control_signal("Closing the valves trips the interlock.")
+    print("Keywords: plural and inflected forms recognised")
+
+
+def test_boilerplate_has_no_control_signal():
+    assert not has_control_signal("Revision history: approved by the project engineer on 2024-01-05.")
+    # Two forms of one keyword are a single keyword
+    assert not has_control_signal("See the pump list. All pumps are listed by area.")
+    print("Keywords: boilerplate and a single repeated keyword skipped")
+
+
+def test_tag_index_offsets():
+    index = TagIndex()
+    pages = list(index.scan_pages(["Start P-101.", "Stop P-101 and V1.0 notes."]))
+    assert pages == ["Start P-101.", "Stop P-101 and V1.0 notes."]
+    assert index.to_dict() == {"P-101": [[1, 6], [2, 5]]}, index.to_dict()
+    print("Tag index: page and offset per occurrence")
+
+
+if __name__ == "__main__":
+    test_tags_found()
+    test_versions_standards_and_quarters_are_not_tags()
+    test_inflected_keywords_count()
+    test_boilerplate_has_no_control_signal()
+    test_tag_index_offsets()
+    print("\nSUCCESS: the tag pre-scan finds tags and control vocabulary without false hits.")
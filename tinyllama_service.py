@@ -1,10 +1,182 @@
 import json
+import logging
+import os
 import re
+import threading
 import time
-from langchain_community.llms import Ollama
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import metrics
+from chunking import get_token_counter, iter_chunks, iter_pdf_pages, iter_structured_chunks
+from ollama_client import CallTimings, OllamaClient
+from result_cache import ChunkCache
+from schema_validator import compile_validator
+from tags import TagIndex, find_tags, has_control_signal
+
+try:
+    import json_repair
+except ImportError:
+    json_repair = None
+
+logger = logging.getLogger(__name__)
 
 # === Configuration ===
 TINYLLAMA_MODEL = "phi3:mini"
+TEMPERATURE = 0.0
+# Number of chunks sent to Ollama at the same time (see OLLAMA_NUM_PARALLEL on the server)
+OLLAMA_CONCURRENCY = int(os.environ.get("OLLAMA_CONCURRENCY", 2))
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+if not OLLAMA_HOST.startswith("http"):
+    OLLAMA_HOST = "http://" + OLLAMA_HOST
+# How long Ollama keeps the model loaded after the last request
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+# Context window: system prompt + chunk + JSON answer must fit
+OLLAMA_NUM_CTX = int(os.environ.get("OLLAMA_NUM_CTX", 4096))
+# Output constraint: "schema" (decoding follows the answer schema in
+# prompts.py), "json" (any JSON object) or "none" (free text, repaired)
+OLLAMA_FORMAT = os.environ.get("OLLAMA_FORMAT", "schema")
+
+# Chunker: "structured" (token budget, cuts at headings/steps/logic blocks/
+# tag tables) or "characters" (the original fixed-size character splitter)
+CHUNK_STRATEGY = os.environ.get("CHUNK_STRATEGY", "structured")
+
+# Structured chunker settings (model tokens). Leave room for the system
+# prompt and the JSON answer inside phi3's context window.
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", 600))
+CHUNK_OVERLAP_TOKENS = 48
+
+# Character chunker settings
+CHUNK_SIZE = 1200
+CHUNK_OVERLAP = 250
+
+# Persistent per-chunk result cache
+CHUNK_CACHE_PATH = os.environ.get("CHUNK_CACHE_PATH", os.path.join(os.getcwd(), "cache", "chunks.sqlite3"))
+CHUNK_CACHE_MAX_ENTRIES = int(os.environ.get("CHUNK_CACHE_MAX_ENTRIES", 20000))
+
+# Conditions-only answers get one short follow-up for the missing categories.
+# Extra LLM time for these follow-ups is capped per document.
+REASK_BUDGET_SECONDS = float(os.environ.get("REASK_BUDGET_SECONDS", 120))
+REASK_NUM_PREDICT = 512
+# Categories a re-ask may fill (only the ones the first answer left empty)
+REASK_CATEGORIES = ["equipment", "parameters", "variables"]
+
+# Tag pre-scan: chunks with no tag and no control vocabulary skip the LLM,
+# and the tags found in a chunk are listed in its message for grounding
+TAG_PRESCAN = os.environ.get("TAG_PRESCAN", "1") != "0"
+
+CATEGORIES = ["equipment", "parameters", "variables", "conditions", "actions"]
+
+_chunk_cache = None
+_chunk_cache_lock = threading.Lock()
+_llm = None
+_llm_lock = threading.Lock()
+
+def get_llm():
+    """Shared Ollama client; the system prompt is its fixed system message."""
+    global _llm
+    with _llm_lock:
+        if _llm is None:
+            from prompts import BALANCED_SYSTEM_PROMPT
+            _llm = OllamaClient(TINYLLAMA_MODEL, base_url=OLLAMA_HOST, system=BALANCED_SYSTEM_PROMPT,
+                                temperature=TEMPERATURE, keep_alive=OLLAMA_KEEP_ALIVE,
+                                num_ctx=OLLAMA_NUM_CTX, format=output_format())
+        return _llm
+
+def output_format(categories=None):
+    """Ollama `format` for an answer with `categories` (all by default), per OLLAMA_FORMAT."""
+    if OLLAMA_FORMAT == "schema":
+        from prompts import ALL_CATEGORIES, category_schema
+        return category_schema(categories or ALL_CATEGORIES)
+    if OLLAMA_FORMAT == "json":
+        return "json"
+    return None
+
+@lru_cache(maxsize=None)
+def _answer_validator(categories):
+    from prompts import category_schema
+    return compile_validator(category_schema(list(categories)))
+
+def preload_llm():
+    """Loads the model in Ollama and warms the system-prompt prefix (call at startup)."""
+    return get_llm().preload()
+
+def get_chunk_cache():
+    """Opens the shared chunk cache on first use."""
+    global _chunk_cache
+    with _chunk_cache_lock:
+        if _chunk_cache is None:
+            _chunk_cache = ChunkCache(CHUNK_CACHE_PATH, max_entries=CHUNK_CACHE_MAX_ENTRIES)
+        return _chunk_cache
+
+def chunk_settings():
+    """Settings that change the LLM answer for a given chunk text."""
+    from prompts import BALANCED_SYSTEM_PROMPT
+    return {
+        "system_prompt": BALANCED_SYSTEM_PROMPT,
+        "prompt_format": "system-message",
+        "model": TINYLLAMA_MODEL,
+        "temperature": TEMPERATURE,
+        "num_ctx": OLLAMA_NUM_CTX,
+        "output_format": OLLAMA_FORMAT,
+        "tag_prescan": TAG_PRESCAN,
+        "collapse_followup": "category-reask",
+    }
+
+def extraction_fingerprint(text_source="pypdf"):
+    """
+    Everything that changes the extraction output for identical PDF bytes.
+    Used by result caches to decide whether a stored result is still valid.
+    `text_source` names the library the page text comes from.
+    """
+    fingerprint = chunk_settings()
+    fingerprint.update({
+        "text_source": text_source,
+        "chunk_strategy": CHUNK_STRATEGY,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "chunk_max_tokens": CHUNK_MAX_TOKENS,
+        "chunk_overlap_tokens": CHUNK_OVERLAP_TOKENS,
+    })
+    return fingerprint
+
+def build_user_message(chunk, known_ids=None):
+    """
+    The per-chunk user message; the system prompt goes separately.
+    `known_ids` (tags found by the pre-scan) are listed after the text so the
+    model copies exact IDs instead of guessing them.
+    """
+    message = f"DATA TO EXTRACT:\n{chunk}"
+    if known_ids:
+        message += "\n\nIDS FOUND IN THIS TEXT: " + ", ".join(known_ids)
+    return message
+
+def iter_document_chunks(pages, stats=None, strategy=None):
+    """
+    Chunks page texts with the configured strategy. When `stats` is given
+    it is filled with the chunk count, the chunk tokens and the total prompt
+    tokens (system prompt included) for comparing chunkers.
+    """
+    strategy = strategy or CHUNK_STRATEGY
+    count_tokens, tokenizer_name = get_token_counter()
+    if strategy == "characters":
+        chunks = iter_chunks(pages, CHUNK_SIZE, CHUNK_OVERLAP)
+    else:
+        chunks = iter_structured_chunks(pages, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, count_tokens)
+    if stats is None:
+        yield from chunks
+        return
+
+    from prompts import BALANCED_SYSTEM_PROMPT
+    prompt_overhead = count_tokens(BALANCED_SYSTEM_PROMPT) + count_tokens(build_user_message(""))
+    stats.update({"strategy": strategy, "tokenizer": tokenizer_name,
+                  "chunks": 0, "chunk_tokens": 0, "prompt_tokens": 0})
+    for chunk in chunks:
+        tokens = count_tokens(chunk)
+        stats["chunks"] += 1
+        stats["chunk_tokens"] += tokens
+        stats["prompt_tokens"] += tokens + prompt_overhead
+        yield chunk
 
 def extract_json_from_text(text):
     """
@@ -15,12 +187,11 @@ def extract_json_from_text(text):
     text = re.sub(r'```\s*', '', text) # Remove closing ticks
     
     # 2. Try json_repair (Most robust)
-    try:
-        import json_repair
+    if json_repair is not None:
         decoded = json_repair.repair_json(text, return_objects=True)
         if decoded:
              return decoded
-    except ImportError:
+    else:
         print("Warning: json_repair not installed. Falling back.")
 
     # 3. Try standard JSON extraction
@@ -35,139 +206,242 @@ def extract_json_from_text(text):
         
     return None
 
-def extract_entities_ollama(pdf_path):
+def parse_answer(raw_output, categories=CATEGORIES, parse_stats=None):
     """
-    Extracts entities from the PDF text using the local Phi-3-mini model.
-    Uses a DETERMINISTIC 5-PASS PIPELINE with REAL ID EXTRACTION.
+    Parses an LLM reply. Output that is already valid JSON matching the
+    answer schema (the normal case with OLLAMA_FORMAT=schema) is returned
+    straight from json.loads; anything else goes through the repair path.
+    Returns the parsed dict or None, and counts the outcome (valid,
+    repaired, failed) in `parse_stats` and on /metrics.
     """
-    start_time = time.time()
-    print(f"--- Starting Extraction for {pdf_path} using Phi-3-mini ---")
-
-    # 1. Read Text from PDF
     try:
-        from pypdf import PdfReader
-        reader = PdfReader(pdf_path)
-        text_content = ""
-        for i, page in enumerate(reader.pages):
-            page_text = page.extract_text()
-            if i == 0:
-                 print("===== STEP 4: VERIFY PDF LOADER OUTPUT (Page 1) =====")
-                 print(page_text)
-                 print("=====================================================")
-            text_content += page_text + "\n"
-            
-        if not text_content.strip():
-            print("CRITICAL ERROR: PDF Text extraction returned empty string!")
-            return {"error": "PDF text extraction failed (empty)"}
-            
-    except Exception as e:
-        return {"error": f"PDF Reading Error: {str(e)}"}
+        parsed = json.loads(raw_output)
+    except ValueError:
+        parsed = None
+    if parsed is not None and _answer_validator(tuple(categories))(parsed):
+        outcome = "valid"
+    else:
+        parsed = extract_json_from_text(raw_output)
+        if not (parsed and isinstance(parsed, dict)):
+            parsed = None
+        outcome = "repaired" if parsed is not None else "failed"
+    metrics.LLM_PARSE.inc(format=OLLAMA_FORMAT, outcome=outcome)
+    if parse_stats is not None:
+        parse_stats.add(outcome)
+    return parsed
+
+class ParseStats:
+    """Per-document counts of reply parse outcomes and parse-failure retries."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {"valid": 0, "repaired": 0, "failed": 0, "retries": 0}
+
+    def add(self, outcome):
+        with self._lock:
+            self.counts[outcome] += 1
 
-    # 2. CHUNK TEXT (Strict Logic-Preserving)
-    # Using RecursiveCharacterTextSplitter to respect sentence boundaries
+    def report(self):
+        with self._lock:
+            counts = dict(self.counts)
+        replies = counts["valid"] + counts["repaired"] + counts["failed"]
+        counts["format"] = OLLAMA_FORMAT
+        counts["failure_rate"] = round(counts["failed"] / replies, 4) if replies else 0.0
+        counts["retry_rate"] = round(counts["retries"] / replies, 4) if replies else 0.0
+        return counts
+
+class ReaskBudget:
+    """
+    Per-document cap on the LLM time spent on category re-asks, plus the
+    numbers for the report. The budget is checked before each re-ask, so
+    concurrent chunks can overshoot it by at most one call each.
+    """
+
+    def __init__(self, max_seconds):
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+        self.reasks = 0
+        self.recovered_items = 0
+        self.over_budget = 0
+        self.seconds = 0.0
+        self.full_retry_seconds = 0.0
+
+    def allow(self):
+        with self._lock:
+            if self.seconds < self.max_seconds:
+                return True
+            self.over_budget += 1
+            return False
+
+    def record(self, seconds, first_call_seconds, recovered):
+        with self._lock:
+            self.reasks += 1
+            self.seconds += seconds
+            # A full-prompt retry would have cost about as much as the first call
+            self.full_retry_seconds += first_call_seconds
+            self.recovered_items += recovered
+
+    def report(self):
+        with self._lock:
+            return {
+                "reasks": self.reasks,
+                "recovered_items": self.recovered_items,
+                "skipped_over_budget": self.over_budget,
+                "seconds": round(self.seconds, 2),
+                "budget_seconds": self.max_seconds,
+                "seconds_saved_vs_full_retry": round(max(0.0, self.full_retry_seconds - self.seconds), 2),
+            }
+
+def _reask_missing(llm, user_message, raw_output, items, index, first_call_seconds, budget, parse_stats=None,
+                   timings=None):
+    """
+    Follows a conditions-only answer with a short turn asking only for the
+    empty categories, and merges what comes back into `items`.
+    Returns (items, complete); complete is False if the re-ask was skipped
+    over budget or failed, so the answer is still the conditions-only one.
+    """
+    from prompts import CATEGORY_REASK_PROMPT
+    missing = [cat for cat in REASK_CATEGORIES if not items[cat]]
+    if budget is not None and not budget.allow():
+        print(f"   Chunk {index+1}: conditions-only answer kept, re-ask budget used up.")
+        return items, False
+
+    print(f"   WARNING: Chunk {index+1}: potential 'Conditions-Only' collapse. Re-asking for {', '.join(missing)}...")
+    history = [{"role": "user", "content": user_message}, {"role": "assistant", "content": raw_output}]
+    prompt = CATEGORY_REASK_PROMPT.format(missing=", ".join(missing), keys=", ".join(f'"{cat}"' for cat in missing))
+    start = time.perf_counter()
+    recovered = 0
+    complete = False
+    metrics.LLM_RETRIES.inc()
     try:
-        from langchain.text_splitter import RecursiveCharacterTextSplitter
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1200,
-            chunk_overlap=250,
-            separators=["\n\n", "\n", ".", " ", ""]
-        )
-        chunks = text_splitter.split_text(text_content)
-    except ImportError:
-        # Fallback if langchain.text_splitter is not available
-        print("RecursiveCharacterTextSplitter not found, using simple slicing.")
-        CHUNK_SIZE = 1200
-        OVERLAP = 250
-        chunks = []
-        if len(text_content) > CHUNK_SIZE:
-             start = 0
-             while start < len(text_content):
-                end = min(start + CHUNK_SIZE, len(text_content))
-                chunks.append(text_content[start:end])
-                if end == len(text_content):
-                    break
-                start += CHUNK_SIZE - OVERLAP
+        with metrics.span("llm_call"):
+            followup = llm.chat(prompt, label=f"chunk {index+1} re-ask", history=history,
+                                format=output_format(missing), timings=timings, num_predict=REASK_NUM_PREDICT)
+        parsed = parse_answer(followup, missing, parse_stats)
+        if parsed is not None:
+            extra = _validate_items(parsed)
+            for category in missing:
+                items[category].extend(extra[category])
+                recovered += len(extra[category])
+            complete = True
+            metrics.LLM_ATTEMPTS.inc(outcome="reask")
         else:
-             chunks = [text_content]
+            metrics.LLM_ATTEMPTS.inc(outcome="parse_failure")
+            print(f"   Warning: Chunk {index+1}: re-ask returned no valid JSON, keeping the first answer.")
+    except Exception as e:
+        metrics.LLM_ATTEMPTS.inc(outcome="error")
+        print(f"    Error in re-ask (chunk {index+1}): {e}")
+    if budget is not None:
+        budget.record(time.perf_counter() - start, first_call_seconds, recovered)
+    return items, complete
 
-    print(f"Processing {len(chunks)} chunks using 5-Pass Real-ID Pipeline...")
+def _extract_chunk(llm, chunk, index, known_ids=None, budget=None, parse_stats=None, timings=None):
+    """
+    Runs the balanced extraction prompt on one chunk (one retry if no valid
+    JSON comes back). A conditions-only answer gets a short follow-up for
+    the missing categories, within the document's ReaskBudget.
+    Returns (items, complete): {category: [items]} with validated items, or
+    None if no valid JSON could be obtained, and whether the answer is a
+    full one (False for a conditions-only answer whose re-ask was skipped
+    or failed).
+    """
+    logger.debug("--- Chunk %d ---", index + 1)
 
-    # 3. MULTI-PASS EXTRACTION LOOP
-    aggregated_data = {
-        "equipment": [], "parameters": [], "variables": [], "conditions": [], "actions": []
-    }
-    
     # SINGLE-PASS BALANCED EXTRACTION
-    from prompts import BALANCED_SYSTEM_PROMPT
-    
-    llm = Ollama(model=TINYLLAMA_MODEL, temperature=0.0)
+    # The system prompt is the client's fixed system message; only the chunk
+    # changes per call, so Ollama can reuse the evaluated prefix
+    user_message = build_user_message(chunk, known_ids)
 
-    for i, chunk in enumerate(chunks):
-        print(f"--- Chunk {i+1}/{len(chunks)} ---")
-        
-        # Construct the Prompt (System + Chunk)
-        # LangChain just concatenates, no rephrasing
-        final_prompt = f"""{BALANCED_SYSTEM_PROMPT}\n\nDATA TO EXTRACT:\n{chunk}"""
+    logger.debug("   -> Invoking Phi-3 (Balanced Pass) on chunk %d...", index + 1)
+    
+    # RETRY LOOP (Max 1 retry for unparseable output)
+    max_retries = 1
+    attempt = 0
+    
+    while attempt <= max_retries:
+        if attempt > 0:
+            metrics.LLM_RETRIES.inc()
+            if parse_stats is not None:
+                parse_stats.add("retries")
+        try:
+            start = time.perf_counter()
+            with metrics.span("llm_call"):
+                raw_output = llm.chat(user_message, label=f"chunk {index+1}", timings=timings)
+            first_call_seconds = time.perf_counter() - start
+            parsed = parse_answer(raw_output, parse_stats=parse_stats)
+            
+            if parsed is not None:
+                items = _validate_items(parsed)
+                # Heuristic: conditions but no equipment/parameters is likely a
+                # "Conditions-Only" collapse; ask again for the missing categories only
+                if items["conditions"] and not items["equipment"] and not items["parameters"]:
+                    metrics.LLM_ATTEMPTS.inc(outcome="collapse")
+                    return _reask_missing(llm, user_message, raw_output, items, index, first_call_seconds, budget,
+                                          parse_stats, timings)
 
-        print(f"   -> Invoking Phi-3 (Balanced Pass)...")
-        
-        # RETRY LOOP (Max 1 retry for Anti-Collapse)
-        max_retries = 1
-        attempt = 0
-        valid_extraction = False
-        
-        while attempt <= max_retries:
-            try:
-                raw_output = llm.invoke(final_prompt)
-                parsed = extract_json_from_text(raw_output)
+                metrics.LLM_ATTEMPTS.inc(outcome="ok")
+                return items, True
+            else:
+                # JSON parse failed
+                metrics.LLM_ATTEMPTS.inc(outcome="parse_failure")
+                print(f"   Warning: Chunk {index+1}: valid JSON not found in attempt {attempt}.")
+                attempt += 1
                 
-                if parsed and isinstance(parsed, dict):
-                    # Check for "Collapse" (Skewed to Conditions only)
-                    eq_count = len(parsed.get('equipment', []))
-                    param_count = len(parsed.get('parameters', []))
-                    cond_count = len(parsed.get('conditions', []))
-                    
-                    # Heuristic: If we have conditions but NO equipment/parameters, it might be collapsed.
-                    if cond_count > 0 and eq_count == 0 and param_count == 0 and attempt < max_retries:
-                        print(f"   WARNING: Detected potential 'Conditions-Only' collapse. Retrying (Attempt {attempt+1}/{max_retries})...")
-                        attempt += 1
-                        continue # Retry with same prompt
-                    
-                    # If we got here, result is either balanced or we ran out of retries
-                    valid_extraction = True
+        except Exception as e:
+            metrics.LLM_ATTEMPTS.inc(outcome="error")
+            print(f"    Error in extraction attempt {attempt} (chunk {index+1}): {e}")
+            attempt += 1
+            
+    print(f"   Failed to extract valid data for chunk {index+1} after retries.")
+    return None, False
+
+def _extract_chunk_cached(llm, chunk, index, cache, settings, known_ids=None, budget=None, parse_stats=None,
+                          timings=None):
+    """
+    Looks the chunk up in the chunk cache before calling the LLM.
+    Returns (items, cache_hit, complete); see _extract_chunk for `complete`.
+    """
+    if cache is None:
+        items, complete = _extract_chunk(llm, chunk, index, known_ids, budget, parse_stats, timings)
+        return items, False, complete
+
+    key = ChunkCache.make_key(chunk, settings)
+    cached = cache.get(key)
+    if cached is not None:
+        logger.debug("--- Chunk %d (cached) ---", index + 1)
+        return cached, True, True
+
+    items, complete = _extract_chunk(llm, chunk, index, known_ids, budget, parse_stats, timings)
+    if complete:
+        # Failed chunks and conditions-only answers kept without a re-ask are
+        # not cached, so they get a full attempt next time
+        cache.put(key, items)
+    return items, False, complete
+
+def _validate_items(parsed):
+    """Keeps well-formed items per category in the shape the UI expects."""
+    items_by_category = {cat: [] for cat in CATEGORIES}
+    for category in CATEGORIES:
+        items = parsed.get(category, [])
+        if isinstance(items, list):
+            for item in items:
+                if isinstance(item, dict):
+                    # Standard Validation
+                    name = (item.get("name") or "").strip()
+                    desc = (item.get("description") or "").strip()
+                    doc_id = (item.get("id") or "").strip()
                     
-                    # Merge into aggregated data
-                    for category in ["equipment", "parameters", "variables", "conditions", "actions"]:
-                        items = parsed.get(category, [])
-                        if isinstance(items, list):
-                            for item in items:
-                                if isinstance(item, dict):
-                                    # Standard Validation
-                                    name = (item.get("name") or "").strip()
-                                    desc = (item.get("description") or "").strip()
-                                    doc_id = (item.get("id") or "").strip()
-                                    
-                                    if not name or len(name) < 2: continue
-                                    
-                                    item_data = {"name": name, "description": desc}
-                                    if category in ["equipment", "parameters", "variables"]:
-                                        item_data["id"] = doc_id
-                                        
-                                    aggregated_data[category].append(item_data)
-                    break # Exit retry loop
-                else:
-                    # JSON parse failed
-                    print(f"   Warning: valid JSON not found in attempt {attempt}.")
-                    attempt += 1
+                    if not name or len(name) < 2: continue
                     
-            except Exception as e:
-                print(f"    Error in extraction attempt {attempt}: {e}")
-                attempt += 1
-                
-        if not valid_extraction:
-            print("   Failed to extract valid data for chunk after retries.")
+                    item_data = {"name": name, "description": desc}
+                    if category in ["equipment", "parameters", "variables"]:
+                        item_data["id"] = doc_id
+                        
+                    items_by_category[category].append(item_data)
+    return items_by_category
 
-    # 4. POST-PROCESSING (Deduplicate ONLY - NO AUTO ID)
+def deduplicate_entities(aggregated_data):
+    """Drops repeated (name, description) pairs per category, keeping first occurrence."""
     final_normalized = {}
     
     for cat in aggregated_data:
@@ -184,7 +458,213 @@ def extract_entities_ollama(pdf_path):
         final_normalized[cat] = list(unique_map.values())
         print(f"Final {cat}: {len(final_normalized[cat])} items")
 
-    print(f"Extraction Finished. Total chunks processed: {len(chunks)}")
+    return final_normalized
+
+def extraction_complete(result):
+    """True if an extraction result has no error and no failed or incomplete chunks (safe to store)."""
+    return "error" not in result and not result.get("failed_chunks") and not result.get("incomplete_chunks")
+
+def _log_first_page(pages):
+    """Passes pages through, logging page 1 at debug level for loader verification."""
+    for i, page_text in enumerate(pages):
+        if i == 0 and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("===== STEP 4: VERIFY PDF LOADER OUTPUT (Page 1) =====\n%s\n"
+                         "=====================================================", page_text)
+        yield page_text
+
+def extract_entities_ollama(pdf_path, concurrency=None, use_cache=True, pages=None, on_chunk=None):
+    """
+    Extracts entities from the PDF text using the local Phi-3-mini model.
+    Uses a DETERMINISTIC 5-PASS PIPELINE with REAL ID EXTRACTION.
+
+    Pages are streamed out of the PDF and chunked incrementally, so the first
+    LLM call starts before the last page is parsed and memory stays bounded
+    by a few chunks, not by document length.
+
+    `pages` may supply the page texts directly (e.g. from split_pdf with
+    with_text=True); otherwise they are read from `pdf_path` with pypdf.
+
+    `concurrency` sets how many chunks are in flight against Ollama at once
+    (defaults to OLLAMA_CONCURRENCY). Results are merged in chunk order.
+    With `use_cache`, unchanged chunks are answered from the chunk cache and
+    the hit/miss counts are reported under "chunk_cache".
+
+    With TAG_PRESCAN, every tag is indexed with its page and offset while
+    the pages stream past ("tags"), chunks without a tag or control
+    vocabulary are answered empty without an LLM call, and the other chunks
+    carry their tags to the model as known IDs.
+
+    `on_chunk(index, items, cache_hit)` is called as soon as each chunk's
+    extraction finishes (in completion order, from a worker thread), before
+    the ordered merge and deduplication; `items` is None for failed chunks.
+
+    Chunks with no valid answer after the retries are counted under
+    "failed_chunks", conditions-only answers left without their re-ask
+    under "incomplete_chunks"; if every chunk sent to the LLM failed (e.g. Ollama is
+    down), an {"error": ...} dict is returned instead of an empty result.
+    """
+    start_time = time.time()
+    print(f"--- Starting Extraction for {pdf_path} using Phi-3-mini ---")
+
+    # 1. Read Text from PDF + 2. CHUNK TEXT (Strict Logic-Preserving)
+    # Both are lazy generators, consumed by the extraction loop below.
+    if pages is None:
+        pages = metrics.timed_iter("text_extraction", iter_pdf_pages(pdf_path))
+    pages = _log_first_page(pages)
+    tag_index = TagIndex()
+    if TAG_PRESCAN:
+        pages = tag_index.scan_pages(pages)
+    chunk_stats = {}
+    chunks = metrics.timed_iter("chunking", iter_document_chunks(pages, chunk_stats))
+
+    print("Processing chunks using 5-Pass Real-ID Pipeline...")
+
+    # 3. MULTI-PASS EXTRACTION LOOP
+    aggregated_data = {cat: [] for cat in CATEGORIES}
+    
+    llm = get_llm()
+    cache = get_chunk_cache() if use_cache else None
+    settings = chunk_settings()
+    cache_stats = {"hits": 0, "misses": 0}
+    llm_calls_avoided = 0
+    reask_budget = ReaskBudget(REASK_BUDGET_SECONDS)
+    parse_stats = ParseStats()
+    # This document's calls only (the client is shared by concurrent documents)
+    llm_timings = CallTimings()
+    failed_chunks = 0
+    incomplete_chunks = 0
+
+    def merge(chunk_items, cache_hit, complete):
+        nonlocal failed_chunks, incomplete_chunks
+        cache_stats["hits" if cache_hit else "misses"] += 1
+        metrics.CHUNKS.inc(source="cache" if cache_hit else ("failed" if chunk_items is None else "llm"))
+        if chunk_items is None:
+            # No valid answer after the retries: counted, so callers can tell
+            # a failed extraction from a document without entities
+            failed_chunks += 1
+            return
+        if not complete:
+            incomplete_chunks += 1
+        for category in CATEGORIES:
+            aggregated_data[category].extend(chunk_items[category])
+
+    # Chunks are submitted as soon as the chunker emits them. The executor
+    # caps concurrent LLM calls at `workers`; at most 2x that many chunks are
+    # queued ahead. Futures are merged oldest-first, so the result is
+    # identical to a serial run.
+    workers = max(1, concurrency or OLLAMA_CONCURRENCY)
+    print(f"Extracting with concurrency={workers}")
+    num_chunks = 0
+    in_flight = deque()
+    def notify_items(index, items, cache_hit):
+        try:
+            on_chunk(index, items, cache_hit)
+        except Exception as e:
+            print(f"Warning: chunk callback failed for chunk {index+1}: {e}")
+
+    def notify(index, future):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            notify_items(index, None, False)
+            return
+        items, cache_hit, _ = future.result()
+        notify_items(index, items, cache_hit)
+
+    def merge_next():
+        index, future = in_flight.popleft()
+        try:
+            result = future.result()
+        except Exception as e:
+            # A worker bug (chunk cache, LLM client) fails this chunk, not the document
+            print(f"    Error in chunk worker (chunk {index+1}): {e}")
+            result = (None, False, False)
+        merge(*result)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        numbered_chunks = enumerate(chunks)
+        while True:
+            # Only reading the pages and chunking them counts as a PDF reading error
+            try:
+                index, chunk = next(numbered_chunks)
+            except StopIteration:
+                break
+            except Exception as e:
+                for _, future in in_flight:
+                    future.cancel()
+                return {"error": f"PDF Reading Error: {str(e)}"}
+
+            num_chunks += 1
+            known_ids = None
+            if TAG_PRESCAN:
+                known_ids = find_tags(chunk)
+                if not has_control_signal(chunk, known_ids):
+                    # Nothing to extract: answer empty, outside the cache stats
+                    logger.debug("--- Chunk %d (no tags or control terms, LLM skipped) ---", index + 1)
+                    metrics.CHUNKS.inc(source="skipped")
+                    llm_calls_avoided += 1
+                    if on_chunk is not None:
+                        notify_items(index, {cat: [] for cat in CATEGORIES}, False)
+                    continue
+            future = executor.submit(_extract_chunk_cached, llm, chunk, index, cache, settings, known_ids,
+                                     reask_budget, parse_stats, llm_timings)
+            if on_chunk is not None:
+                future.add_done_callback(lambda f, index=index: notify(index, f))
+            in_flight.append((index, future))
+            if len(in_flight) >= 2 * workers:
+                merge_next()
+
+        while in_flight:
+            merge_next()
+
+    if num_chunks == 0:
+        print("CRITICAL ERROR: PDF Text extraction returned empty string!")
+        return {"error": "PDF text extraction failed (empty)"}
+
+    llm_chunks = num_chunks - llm_calls_avoided
+    if llm_chunks and failed_chunks == llm_chunks:
+        print(f"CRITICAL ERROR: LLM extraction failed for all {llm_chunks} chunks!")
+        return {"error": f"LLM extraction failed for all {llm_chunks} chunks", "failed_chunks": failed_chunks}
+    if failed_chunks:
+        print(f"WARNING: {failed_chunks} of {llm_chunks} chunks failed, the result is partial.")
+
+    # 4. POST-PROCESSING (Deduplicate ONLY - NO AUTO ID)
+    with metrics.span("dedup"):
+        final_normalized = deduplicate_entities(aggregated_data)
+
+    print(f"Extraction Finished. Total chunks processed: {num_chunks} in {time.time() - start_time:.1f}s")
+    print(f"Chunking ({chunk_stats['strategy']}): {chunk_stats['chunks']} chunks, "
+          f"{chunk_stats['prompt_tokens']} prompt tokens ({chunk_stats['tokenizer']})")
+    final_normalized["chunking"] = chunk_stats
+    final_normalized["failed_chunks"] = failed_chunks
+    final_normalized["incomplete_chunks"] = incomplete_chunks
+    final_normalized["llm_timing"] = llm_timings.report()
+    print(f"LLM: {final_normalized['llm_timing']['calls']} calls, "
+          f"prompt eval {final_normalized['llm_timing']['prompt_eval_ms']:.0f}ms, "
+          f"generation {final_normalized['llm_timing']['eval_ms']:.0f}ms")
+    reask = reask_budget.report()
+    if reask["reasks"] or reask["skipped_over_budget"]:
+        print(f"Category re-asks: {reask['reasks']} ({reask['recovered_items']} items recovered, "
+              f"{reask['seconds']:.1f}s, ~{reask['seconds_saved_vs_full_retry']:.1f}s saved vs full retries, "
+              f"{reask['skipped_over_budget']} skipped over budget)")
+    final_normalized["collapse_reask"] = reask
+    parse = parse_stats.report()
+    print(f"LLM replies ({parse['format']} format): {parse['valid']} valid, {parse['repaired']} repaired, "
+          f"{parse['failed']} failed, {parse['retries']} retries")
+    final_normalized["llm_parse"] = parse
+    if TAG_PRESCAN:
+        occurrences = sum(len(found) for found in tag_index.occurrences.values())
+        print(f"Tag pre-scan: {len(tag_index)} tags ({occurrences} occurrences), "
+              f"{llm_calls_avoided} of {num_chunks} LLM calls avoided")
+        final_normalized["tags"] = {
+            "unique": len(tag_index),
+            "occurrences": occurrences,
+            "llm_calls_avoided": llm_calls_avoided,
+            "index": tag_index.to_dict(),
+        }
+    if use_cache:
+        print(f"Chunk cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+        final_normalized["chunk_cache"] = cache_stats
     
     # Add dummy prompt for UI compatibility
     final_normalized["used_prompt"] = "Multi-pass Real-ID extraction utilized."